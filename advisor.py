@@ -0,0 +1,167 @@
+import os
+import asyncio
+import concurrent.futures as cf
+import main
+from board import Board
+from planner import warm_planner
+
+# Boards solved ahead for each of the top actions of the current board, and how many actions
+speculate = 10
+top_actions = 2
+# Solved boards kept for when they come up again, oldest dropped first
+keep = 256
+
+def solve_state(args):
+    """
+    :param args: (state_key, (deck, placeholder_dps, combo_count), settings) where settings is a
+                 dict of Planner keyword arguments
+    :return: (action, v_star, {action: q_star}) from Planner.recommend
+    """
+    key, (deck, placeholder_dps, combo_count), settings = args
+    planner = warm_planner(deck, **settings)
+    Board.PLACEHOLDER_DPS = placeholder_dps
+    Board.COMBO_COUNT = combo_count
+    return planner.recommend(Board.from_key(key, list(deck)))
+
+class Advisor:
+
+    def __init__(self, deck, executor, settings):
+        """
+        Keeps a future of every board submitted to executor, so boards solved ahead of time are
+        answered as soon as they come up
+        :param settings: dict of Planner keyword arguments
+        """
+        self._deck = deck
+        self._executor = executor
+        self._settings = settings
+        self._futures = {}
+        self._hits = 0
+        self._misses = 0
+        self._cancelled = 0
+
+    def submit(self, board, params = None):
+        """
+        :param params: Board.dps_params to solve board under, defaults to the current ones
+        :return: concurrent.futures.Future of solve_state for board
+        """
+        key = (board.key(), params or Board.dps_params(self._deck))
+        future = self._futures.get(key)
+        if future is None or Advisor.failed(future):
+            self._futures[key] = self._executor.submit(solve_state, (board.key(), key[1], self._settings))
+        return self._futures[key]
+    
+    @classmethod
+    def failed(cls, future):
+        """
+        :return: True if future was cancelled or raised, so it has no result worth keeping
+        """
+        return future.cancelled() or (future.done() and future.exception() is not None)
+
+    def speculate(self, board, q_stars):
+        """
+        Submits every outcome of the top_actions actions of board with the highest q star, up to
+        speculate boards
+        """
+        states = board.next_states()
+        ranked = sorted(q_stars, key = q_stars.get, reverse = True)[:top_actions]
+        submitted = 0
+        for action in ranked:
+            deck, placeholder_dps, combo_count = Board.dps_params(self._deck)
+            tokens = action.split('_')
+            # Board.merge_dice counts every combo merged into a real die
+            if tokens[0] == 'm' and board.dice_at_cell(int(tokens[1]) - 1) == Board.COMBO:
+                combo_count += 1
+            # Stochastic plans also rank SPAWN, whose outcomes are every die of the deck spawned
+            if action == Board.SPAWN:
+                outcomes = board.spawn_outcomes()
+            else:
+                outcomes = board.outcomes(states[action])
+            for outcome, prob in outcomes.values():
+                if submitted == speculate:
+                    return
+                self.submit(outcome, (deck, placeholder_dps, combo_count))
+                submitted += 1
+
+    def retain(self, board):
+        """
+        Cancels every pending solve besides the one of board, which the user has moved past, drops
+        failed solves and keeps the keep most recent results
+        """
+        current = (board.key(), Board.dps_params(self._deck))
+        for key in list(self._futures):
+            future = self._futures[key]
+            if key == current:
+                continue
+            if not future.done():
+                if future.cancel():
+                    self._cancelled += 1
+                del self._futures[key]
+            elif Advisor.failed(future):
+                del self._futures[key]
+        solved = [key for key in self._futures if key != current and self._futures[key].done()]
+        for key in solved[:max(len(solved) - keep, 0)]:
+            del self._futures[key]
+
+    async def advise(self, board):
+        """
+        Prints the step for board once it is solved, then solves the boards that likely follow
+        """
+        future = self.submit(board)
+        ahead = future.done()
+        if ahead:
+            self._hits += 1
+        else:
+            self._misses += 1
+        try:
+            # Shielded so that cancelling this task leaves the solve to retain, which keeps it if
+            # the board comes up again
+            action, v_star, q_stars = await asyncio.shield(asyncio.wrap_future(future))
+        except Exception:
+            action = None
+        if action is None:
+            print('No optimal step here')
+            return
+        print(f'Optimal step with depth {self._settings["depth"]} and breadth {self._settings["breadth"]}: '
+              f'{action}{" (solved ahead)" if ahead else ""}')
+        self.speculate(board, q_stars)
+
+    def stats(self):
+        return {'hits': self._hits, 'misses': self._misses, 'cancelled': self._cancelled,
+                'pending': sum(not future.done() for future in self._futures.values())}
+
+async def run():
+
+    deck = ['c', 'j', 'o', 'g', 'm']
+    board = Board.new_board(deck)
+    print(f'Initialized empty Board with deck: {deck}')
+    print(board)
+    settings = {'depth': main.depth, 'breadth': main.breadth, 'gamma': 0.5, 'solver': main.solver,
+                'stochastic': main.stochastic, 'heuristic': main.heuristic, 'unique': main.unique}
+    loop = asyncio.get_running_loop()
+
+    workers = main.processes or os.cpu_count()
+    with cf.ProcessPoolExecutor(workers) as executor:
+        # Every worker is started before the input thread, so none is forked while it holds stdin
+        list(executor.map(abs, range(workers)))
+        advisor = Advisor(deck, executor, settings)
+        while True:
+
+            main.prompt(deck)
+            task = asyncio.ensure_future(advisor.advise(board))
+
+            command = await loop.run_in_executor(None, input, 'Next command:\n')
+            board, cont = main.process_command(command, board)
+            task.cancel()
+            if main.stats:
+                print(advisor.stats())
+
+            if not cont:
+                print('Bye!')
+                advisor.retain(board)
+                break
+
+            advisor.retain(board)
+            print(board)
+
+if __name__ == '__main__':
+    asyncio.run(run())
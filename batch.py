@@ -0,0 +1,68 @@
+import sys
+import json
+import time
+import argparse
+import multiprocessing as mp
+from board import Board
+from planner import warm_planner
+
+def advise(args):
+    """
+    :param args: (line, default_deck, (depth, breadth, gamma, solver))
+    :return: dict of the recommendation for the line, with an error instead if it is malformed
+    """
+    line, default_deck, settings = args
+    tokens = line.split()
+    row = {'state': tokens[0] if len(tokens) > 0 else line}
+    try:
+        assert 1 <= len(tokens) <= 2, f'Expected state_str [deck], got: {line}'
+        deck = tokens[1].split(',') if len(tokens) == 2 else default_deck
+        assert deck is not None, 'No deck provided'
+        planner = warm_planner(deck, *settings)
+        action, v_star, q_stars = planner.recommend(Board.parse_state_str(tokens[0], deck))
+        row.update({'deck': deck, 'action': action, 'v': v_star, 'q': q_stars})
+    except (AssertionError, KeyError, ValueError) as e:
+        row['error'] = str(e)
+    return row
+
+def run(lines, out, deck = None, settings = (3, 10, 0.5, 'dict'), processes = None):
+    """
+    Streams one JSON recommendation per non-empty line of 'state_str [deck]' to out
+    :return: number of rows written
+    """
+    tasks = ((line, deck, settings) for line in lines if line.strip())
+    pool = mp.Pool(processes) if processes else None
+    rows = pool.imap(advise, tasks, chunksize = 16) if pool is not None else map(advise, tasks)
+    count = 0
+    try:
+        for row in rows:
+            out.write(json.dumps(row) + '\n')
+            count += 1
+    finally:
+        if pool is not None:
+            pool.close()
+    return count
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Recommend a step for every board in a file')
+    parser.add_argument('input', nargs = '?', default = '-', help = 'lines of "state_str [deck]", - for stdin')
+    parser.add_argument('-o', '--output', default = '-', help = 'JSONL output, - for stdout')
+    parser.add_argument('--deck', help = 'comma separated deck for lines without one')
+    parser.add_argument('--depth', type = int, default = 3)
+    parser.add_argument('--breadth', type = int, default = 10)
+    parser.add_argument('--gamma', type = float, default = 0.5)
+    parser.add_argument('--solver', default = 'dict')
+    parser.add_argument('--processes', type = int)
+    args = parser.parse_args(argv)
+    
+    lines = sys.stdin if args.input == '-' else open(args.input)
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    deck = args.deck.split(',') if args.deck else None
+    start = time.time()
+    count = run(lines, out, deck, (args.depth, args.breadth, args.gamma, args.solver), args.processes)
+    elapsed = time.time() - start
+    out.flush()
+    print(f'{count} rows in {elapsed:.2f}s, {count / max(elapsed, 1e-9):.1f} rows/s', file = sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+import mdp
+from board import Board
+from planner import transitions
+
+FILL_LEVELS = [3, 8, 12, 15]
+GRID = [(1, 5), (2, 5), (2, 10), (3, 10)]
+
+def random_deck(rng):
+    return rng.sample(sorted(Board.all_dice()), Board.DECK_LIMIT)
+
+def random_board(deck, fill, rng, max_pip = 3):
+    """
+    :return: board from deck with fill random cells spawned with pips up to max_pip
+    """
+    board = Board.new_board(deck)
+    for cell in rng.sample(range(Board.CELL_LIMIT), fill):
+        board = board.spawn_dice(rng.choice(deck), cell, rng.randint(1, max_pip))
+    return board
+
+def timeit(func, items, repeat):
+    """
+    :return: dict of median and min seconds per call of func over items, best of repeat rounds
+    """
+    rounds = []
+    for r in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        rounds.append((time.perf_counter() - start) / len(items))
+    return {'median': statistics.median(rounds), 'min': min(rounds), 'calls': len(items) * repeat}
+
+def solve(board, depth, breadth, solver):
+    states, actions, trans_probs, rewards = transitions(board.mdp_params(depth, breadth))
+    if len(actions) == 0:
+        return None
+    return mdp.MDP(states, actions, trans_probs, lambda s, a, r: rewards[(s, a, r)], 0.5, solver = solver)
+
+def run(seed = 0, decks = 2, boards = 20, repeat = 5, solver = 'dict'):
+    """
+    :return: dict of {benchmark: timings} over seeded random boards per deck and fill level
+    """
+    rng = random.Random(seed)
+    all_decks = [random_deck(rng) for i in range(decks)]
+    results = {}
+    memory = {}
+    for deck in all_decks:
+        name = ''.join(deck)
+        
+        def fresh(board):
+            # Rebuilt from the key so that nothing computed by an earlier round is reused
+            return Board.from_key(board.key(), deck)
+        
+        def dps_cold(board):
+            Board.invalidate_dps_cache()
+            return board.dps()
+        
+        for fill in FILL_LEVELS:
+            sample = [random_board(deck, fill, rng) for i in range(boards)]
+            results[f'next_states/deck={name}/fill={fill}'] = timeit(lambda b: fresh(b).next_states(), sample, repeat)
+            results[f'possible_merges/deck={name}/fill={fill}'] = \
+                timeit(lambda b: fresh(b).possible_merges(), sample, repeat)
+            results[f'dps_cold/deck={name}/fill={fill}'] = timeit(dps_cold, sample, repeat)
+            results[f'dps_warm/deck={name}/fill={fill}'] = timeit(Board.dps, sample, repeat)
+        sample = [random_board(deck, FILL_LEVELS[-2], rng) for i in range(max(1, boards // 4))]
+        for depth, breadth in GRID:
+            results[f'mdp_params/deck={name}/depth={depth},breadth={breadth}'] = \
+                timeit(lambda b: fresh(b).mdp_params(depth, breadth), sample, repeat)
+            results[f'solve/deck={name}/depth={depth},breadth={breadth}'] = \
+                timeit(lambda b: solve(fresh(b), depth, breadth, solver), sample, repeat)
+            trees = [fresh(b).mdp_params(depth, breadth) for b in sample]
+            for tree in trees:
+                for action_dict in tree.values():
+                    for result in action_dict.values():
+                        result.dps_delta()
+            bytes_per_node, nodes = Board.node_memory(r for tree in trees for d in tree.values() for r in d.values())
+            memory[f'mdp_params/deck={name}/depth={depth},breadth={breadth}'] = \
+                {'bytes_per_node': bytes_per_node, 'nodes': nodes}
+    return {'meta': {'seed': seed, 'decks': all_decks, 'boards': boards, 'repeat': repeat, 'solver': solver},
+            'results': results, 'memory': memory}
+
+def compare(report, baseline, tolerance):
+    """
+    :return: list of (benchmark, baseline median, median) that slowed down by more than tolerance
+    """
+    regressions = []
+    for name, timing in report['results'].items():
+        base = baseline['results'].get(name)
+        if base is not None and timing['median'] > base['median'] * (1 + tolerance):
+            regressions.append((name, base['median'], timing['median']))
+    return regressions
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark board expansion, DPS evaluation and solving')
+    parser.add_argument('-o', '--output', default = 'bench_output.txt', help = 'JSON report, - for stdout')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--decks', type = int, default = 2, help = 'random decks drawn from the catalog')
+    parser.add_argument('--boards', type = int, default = 20, help = 'random boards per deck and fill level')
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--solver', default = 'dict')
+    parser.add_argument('--compare', help = 'baseline JSON report to check for regressions')
+    parser.add_argument('--tolerance', type = float, default = 0.2, help = 'allowed slow down, 0.2 is 20%%')
+    args = parser.parse_args(argv)
+    
+    report = run(args.seed, args.decks, args.boards, args.repeat, args.solver)
+    text = json.dumps(report, indent = 2)
+    if args.output == '-':
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for name, base, median in regressions:
+            print(f'REGRESSION {name}: {base * 1e3:.3f}ms -> {median * 1e3:.3f}ms', file = sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,29 @@
+import sys
+import heapq
 import random
-import deprecation
 import itertools as it
-import pandas as pd
+import catalog
+import instrument
+from cache import LRUCache
 
 DEBUG = False
 
+def cell_codes(empty, pip_bits, pip_limit):
+    """
+    :return: dict of {cell_str: code} packing each cell into one byte, with the die letter
+             ordinal (a = 1) above pip_bits bits of pip. Empty cells are 0
+    """
+    codes = {empty: 0}
+    for d in range(26):
+        for pip in range(1, pip_limit + 1):
+            codes[chr(ord('a') + d) + str(pip)] = (d + 1) << pip_bits | pip
+    return codes
+
 class Board:
+    
+    # Boards are immutable once built, so results can share the codes and speed ups of their parent
+    __slots__ = ('_codes', '_deck', '_key', '_merge_index', '_parent', '_changed', '_dps_delta', '_num_moons',
+                 '_spd_ups', '_spd_changed')
         
     CELL_LIMIT = 15
     DECK_LIMIT = 5
@@ -27,24 +45,223 @@ class Board:
     PLACEHOLDER_DICE = 'x'
     PLACEHOLDER_DPS = 0
     
-    CACHED_DPS = {}
+    # Action of spawning a random die of the deck on a random empty cell
+    SPAWN = 's'
+    
+    PIP_BITS = 3
+    CELL_CODES = cell_codes(EMPTY, PIP_BITS, PIP_LIMIT)
+    CELL_STRS = {code: cell for cell, code in CELL_CODES.items()}
+    DICE_OF_CODE = {code: cell[:-1] for cell, code in CELL_CODES.items()}
+    PIP_OF_CODE = {code: int(cell[-1]) for cell, code in CELL_CODES.items()}
     
-    ALL_DICE = {
-        id_no: {
-            'name': name,
-            'class': class_lvl,
-            'mtd': mtd,
-            'atk_spd': spd
-        } for id_no, name, class_lvl, mtd, spd in [d.values() \
-          for d in pd.read_csv('all_dice.txt').to_dict(orient = 'records')]
+    DPS_CACHE_SIZE = 2 ** 16
+    CACHED_DPS = LRUCache(DPS_CACHE_SIZE)
+    DPS_TABLES = LRUCache(16)
+    DPS_PARAMS = {}
+    
+    # Fewest boards in a search layer worth expanding across a pool
+    PARALLEL_MIN_BOARDS = 64
+    
+    # Beam scores, {name: score method}. See select_beam
+    HEURISTICS = {
+        'dps': 'dps',
+        'merge': 'merge_potential',
+        'moon': 'moon_value'
     }
     
+    # Static lookup tables, see build_static_tables
+    ADJACENT = ()
+    SYMMETRIES = ()
+    MOON_PIP_OF_CODE = {}
+    MOON_SPD_UPS = {}
+    NO_SPD_UPS = (1,) * CELL_LIMIT
+    ALL_CELLS = frozenset(range(CELL_LIMIT))
+    
+    # Dice catalog, None for catalog.DICE_PATH. Loaded on first use
+    DICE_PATH = None
+    
     @classmethod
-    def new_board(cls, deck):
+    def new_board(cls, deck, store = None):
+        """
+        :param store: optional store.Store whose DPS values for deck are loaded into CACHED_DPS
+        """
+        cls.check_deck(deck)
+        cls.PLACEHOLDER_DPS = 0
         cls.PLACEHOLDER_DPS = sum([cls([cls.EMPTY] * cls.CELL_LIMIT, deck).spawn_dice(d, 0).dps() / len(deck)\
                               for d in deck])
+        cls.dps_table(deck)
+        if store is not None:
+            cls.load_dps_cache(store, deck)
         return cls([cls.EMPTY] * cls.CELL_LIMIT, deck)
+    
+    @classmethod
+    def check_deck(cls, deck):
+        """
+        Asserts deck can be played, before new_board changes any class state for it
+        """
+        assert len(deck) == cls.DECK_LIMIT, f'Invalid deck length provided: {len(deck)}'
+        unknown = [dice for dice in deck if dice not in cls.all_dice()]
+        assert not unknown, f'Unknown dice in deck: {unknown}'
+    
+    @classmethod
+    def build_static_tables(cls):
+        """
+        Precomputes the deck independent tables: adjacency, the speed up contribution of each cell
+        code, and the speed up for each (max adjacent moon pip, number of moons)
+        """
+        cls.ADJACENT = tuple(tuple(cls.adjacent_cells_of(i)) for i in range(cls.CELL_LIMIT))
+        # Cell i of a mirrored board holds cell perm[i] of the original. Each perm is its own inverse
+        rows = [list(range(r * 5, (r + 1) * 5)) for r in range(3)]
+        cls.SYMMETRIES = tuple(tuple(it.chain(*[row[::step] for row in rows[::order]])) \
+                               for order in [1, -1] for step in [1, -1])
+        cls.MOON_PIP_OF_CODE = {code: 0 for code in cls.CELL_STRS}
+        for code, dice in cls.DICE_OF_CODE.items():
+            if dice == cls.MOON:
+                cls.MOON_PIP_OF_CODE[code] = cls.PIP_OF_CODE[code]
+            elif dice == cls.PLACEHOLDER_DICE:
+                cls.MOON_PIP_OF_CODE[code] = cls.PIP_OF_CODE[code] / cls.DECK_LIMIT
+        cls.MOON_SPD_UPS = {}
+        for num_moons in range(cls.CELL_LIMIT + 1):
+            for pip in set(cls.MOON_PIP_OF_CODE.values()):
+                if pip == 0:
+                    cls.MOON_SPD_UPS[(pip, num_moons)] = 1
+                elif cls.moon_mode(num_moons):
+                    cls.MOON_SPD_UPS[(pip, num_moons)] = 1 + pip * cls.MOON_ACTIVE_SPD_UP_PP
+                else:
+                    cls.MOON_SPD_UPS[(pip, num_moons)] = 1 + pip * cls.MOON_BASE_SPD_UP_PP
+    
+    @classmethod
+    def dps_table(cls, deck):
+        """
+        :return: dict of {(cell_code, spd_up): dps} for the deck under the current dps_params
+        """
+        params = cls.dps_params(deck)
+        table = cls.DPS_TABLES.get(params)
+        if table is None:
+            table = cls.build_dps_table(deck)
+            cls.DPS_TABLES.put(params, table)
+        return table
+    
+    @classmethod
+    def build_dps_table(cls, deck):
+        table = {}
+        spd_ups = set(cls.MOON_SPD_UPS.values())
+        die = [dice for dice in cls.all_dice() if dice != cls.JOKER] + [cls.PLACEHOLDER_DICE]
+        for pip in range(1, cls.PIP_LIMIT + 1):
+            for spd_up in spd_ups:
+                for dice in die:
+                    table[(cls.CELL_CODES[dice + str(pip)], spd_up)] = cls.base_dice_dps(dice, pip, spd_up)
+                # Joker takes the value of its best substitute in the deck
+                subs = [table[(cls.CELL_CODES[d + str(pip)], spd_up)] for d in deck if d != cls.JOKER]
+                if len(subs) > 0:
+                    table[(cls.CELL_CODES[cls.JOKER + str(pip)], spd_up)] = max(subs)
+        return table
+    
+    @classmethod
+    def base_dice_dps(cls, dice, pip, spd_up):
+        if dice == cls.PLACEHOLDER_DICE:
+            return cls.PLACEHOLDER_DPS * pip * spd_up
+        mtd = cls.all_dice()[dice].mtd
+        spd = cls.all_dice()[dice].atk_spd
+        if dice == cls.COMBO:
+            return (mtd + cls.COMBO_COUNT * cls.COMBO_DPSPC) * pip * spd_up / spd
+        if dice == cls.GROWTH and pip < 7:
+            return cls.PLACEHOLDER_DPS * min(pip + 1, 7) * spd_up
+        return mtd * pip * spd_up / spd
         
+    @classmethod
+    def all_dice(cls):
+        """
+        :return: dict of {id: catalog.Dice}
+        """
+        return catalog.load(cls.DICE_PATH)
+    
+    @classmethod
+    def dps_params(cls, deck):
+        """
+        :return: tuple of everything besides the cells that dice_dps depends on
+        """
+        params = (tuple(deck), cls.PLACEHOLDER_DPS, cls.COMBO_COUNT)
+        # One shared tuple per distinct params, as every cached value and board delta holds one
+        return cls.DPS_PARAMS.setdefault(params, params)
+    
+    @classmethod
+    def set_dps_cache(cls, cache):
+        """
+        :param cache: object with the LRUCache get/put/invalidate/stats interface
+        """
+        cls.CACHED_DPS = cache
+    
+    @classmethod
+    def invalidate_dps_cache(cls, deck = None):
+        """
+        :param deck: only drop entries computed for this deck. Drops everything if None
+        :return: number of entries dropped
+        """
+        if deck is None:
+            return cls.CACHED_DPS.invalidate()
+        return cls.CACHED_DPS.invalidate(lambda key: key[0][0] == tuple(deck))
+    
+    @classmethod
+    def load_dps_cache(cls, store, deck):
+        """
+        :param store: store.Store to read DPS values computed with the current dps_params of deck from
+        :return: number of values loaded
+        """
+        params = cls.dps_params(deck)
+        values = store.get_dps(params, cls.DPS_CACHE_SIZE)
+        for key, dps in values.items():
+            cls.CACHED_DPS.put((params, key), dps)
+        return len(values)
+    
+    @classmethod
+    def save_dps_cache(cls, store, deck = None):
+        """
+        :param store: store.Store to write the values of CACHED_DPS to
+        :param deck: only write values computed for this deck. Writes everything if None
+        """
+        values = {}
+        for (params, key), dps in cls.CACHED_DPS.items():
+            if deck is None or params[0] == tuple(deck):
+                values.setdefault(params, []).append((key, dps))
+        for params, items in values.items():
+            store.put_dps(params, items)
+    
+    @classmethod
+    def dps_cache_stats(cls):
+        return cls.CACHED_DPS.stats()
+    
+    @classmethod
+    def node_memory(cls, boards):
+        """
+        :param boards: iterable of boards, such as every result of an mdp_params search
+        :return: (average bytes per distinct board, number of distinct boards). Structure shared
+                 between boards, such as speed ups carried over from a parent, is counted once
+        """
+        seen = set()
+        def sizeof(obj):
+            if obj is None or id(obj) in seen:
+                return 0
+            seen.add(id(obj))
+            size = sys.getsizeof(obj)
+            if isinstance(obj, dict):
+                size += sum(sizeof(k) + sizeof(v) for k, v in obj.items())
+            elif isinstance(obj, (tuple, list, set, frozenset)):
+                size += sum(sizeof(v) for v in obj)
+            return size
+        total = 0
+        count = 0
+        for board in boards:
+            if id(board) in seen:
+                continue
+            count += 1
+            total += sizeof(board)
+            # The parent and the deck are shared with other boards
+            for name in cls.__slots__:
+                if name not in ('_parent', '_deck'):
+                    total += sizeof(getattr(board, name))
+        return total / max(count, 1), count
+    
     @classmethod
     def next_board(cls, cells, deck):
         return cls(cells, deck)
@@ -53,9 +270,55 @@ class Board:
     def parse_state_str(cls, state_str, deck):
         cells = state_str.split(',')
         return cls(cells, deck)
+    
+    @classmethod
+    def from_codes(cls, codes, deck, parent = None, changed = None):
+        """
+        :param codes: bytes of 15 cell codes, see CELL_CODES
+        :param parent, changed: board these codes were derived from and the cells that differ,
+                                used to update speed ups and DPS incrementally
+        """
+        board = cls.__new__(cls)
+        board._init(codes, deck, parent, changed)
+        return board
+    
+    @classmethod
+    def from_key(cls, key, deck, parent = None):
+        """
+        :param parent: board the key was derived from, so speed ups and DPS update incrementally
+        """
+        codes = key.to_bytes(cls.CELL_LIMIT, 'little')
+        if parent is None:
+            board = cls.from_codes(codes, deck)
+        else:
+            changed = tuple(i for i in range(cls.CELL_LIMIT) if codes[i] != parent._codes[i])
+            board = cls.from_codes(codes, deck, parent, changed)
+        board._key = key
+        return board
+    
+    @classmethod
+    def state_str_to_key(cls, state_str):
+        return int.from_bytes(bytes(cls.CELL_CODES[cell] for cell in state_str.split(',')), 'little')
+    
+    @classmethod
+    def key_to_state_str(cls, key):
+        return ','.join(cls.CELL_STRS[code] for code in key.to_bytes(cls.CELL_LIMIT, 'little'))
       
+    @classmethod
+    def moon_mode(cls, num_moons):
+        """
+        :return: which speed up rule applies to a board with num_moons moons
+        """
+        if num_moons == 0:
+            return None
+        return num_moons in [3, 5, 7]
+    
     @classmethod
     def adjacent_cells(cls, i):
+        return cls.ADJACENT[i]
+      
+    @classmethod
+    def adjacent_cells_of(cls, i):
         adj = []
         if i < 10:
             adj.append(i + 5)
@@ -73,90 +336,330 @@ class Board:
         :param deck: list of int representing die in deck
         """
         assert len(cells) == Board.CELL_LIMIT, f'Invalid cells provided: {len(cells)}'
+        assert all(cell in Board.CELL_CODES for cell in cells), f'Invalid cells provided: {cells}'
+        self._init(bytes(Board.CELL_CODES[cell] for cell in cells), deck)
+        
+    def _init(self, codes, deck, parent = None, changed = None):
         assert len(deck) == Board.DECK_LIMIT, f'Invalid deck length provided: {len(deck)}'
-        self._cells = cells
+        self._codes = codes
         self._deck = deck
-        self.init_spd_up()
+        self._key = None
+        self._merge_index = None
+        self._parent = parent
+        self._changed = changed
+        self._dps_delta = None
+        self._spd_ups = None
+        self._spd_changed = None
+        if parent is None:
+            self._num_moons = sum(1 for code in codes if Board.MOON_PIP_OF_CODE[code] > 0)
+        else:
+            self._num_moons = parent._num_moons + sum(self.is_moon(c) - parent.is_moon(c) for c in changed)
         
-    def init_spd_up(self):
-        self._spd_ups = [1] * Board.CELL_LIMIT
+    def is_moon(self, cell):
+        return Board.MOON_PIP_OF_CODE[self._codes[cell]] > 0
         
-        non_moon_indices = [i for i in range(Board.CELL_LIMIT) \
-                            if self.dice_at_cell(i) != Board.MOON or self.dice_at_cell(i) != Board.PLACEHOLDER_DICE]
-        num_moons = len([i for i in range(Board.CELL_LIMIT) \
-                     if self.dice_at_cell(i) == Board.MOON or self.dice_at_cell(i) == Board.PLACEHOLDER_DICE])
-        if num_moons == 0:
-            return
-        for i in non_moon_indices:
-            adj = Board.adjacent_cells(i)
-            adj_moon_pips = [self.pip_at_cell(j) for j in adj if self.dice_at_cell(j) == Board.MOON]
-            adj_x_pips = [self.pip_at_cell(j) / Board.DECK_LIMIT \
-                          for j in adj if self.dice_at_cell(j) == Board.PLACEHOLDER_DICE]
-            adj_pips = adj_moon_pips + adj_x_pips
-            if len(adj_pips) == 0:
-                continue
-            max_adj_moon_pip = max(adj_pips)
-            if num_moons in [3, 5, 7]:
-                self._spd_ups[i] = 1 + max_adj_moon_pip * Board.MOON_ACTIVE_SPD_UP_PP
+    def spd_ups(self):
+        """
+        :return: tuple of the speed up of every cell, computed on first use
+        """
+        if self._spd_ups is None:
+            if self._parent is None:
+                self.init_spd_up()
             else:
-                self._spd_ups[i] = 1 + max_adj_moon_pip * Board.MOON_BASE_SPD_UP_PP
+                self._spd_changed = self.derive_spd_up(self._parent, self._changed)
+        return self._spd_ups
+        
+    def init_spd_up(self):
+        if self._num_moons == 0:
+            self._spd_ups = Board.NO_SPD_UPS
+        else:
+            self._spd_ups = tuple(self.spd_up_at(i) for i in range(Board.CELL_LIMIT))
+    
+    def derive_spd_up(self, parent, changed):
+        """
+        Only recomputes speed ups next to changed moons, unless the moon count crosses a rule.
+        Shares the speed ups of parent when none of them change
+        :return: set of cells whose speed up may differ from parent
+        """
+        if Board.moon_mode(self._num_moons) != Board.moon_mode(parent._num_moons):
+            self.init_spd_up()
+            return Board.ALL_CELLS
+        self._spd_ups = parent.spd_ups()
+        if self._num_moons == 0:
+            return frozenset()
+        affected = {j for c in changed if self.is_moon(c) or parent.is_moon(c) \
+                    for j in Board.adjacent_cells(c)}
+        if len(affected) > 0:
+            spd_ups = list(self._spd_ups)
+            for i in affected:
+                spd_ups[i] = self.spd_up_at(i)
+            self._spd_ups = tuple(spd_ups)
+        return affected
+        
+    def spd_up_at(self, i):
+        max_adj_moon_pip = max(Board.MOON_PIP_OF_CODE[self._codes[j]] for j in Board.ADJACENT[i])
+        return Board.MOON_SPD_UPS[(max_adj_moon_pip, self._num_moons)]
         
     def __str__(self):
         ret = ''
         for i in range(3):
-            ret += str(self._cells[i * 5:(i + 1) * 5]) + '\n'
+            ret += str(self.cells()[i * 5:(i + 1) * 5]) + '\n'
         return f'{ret[:-1]}\nDPS: {self.dps()}'
     
-    def mdp_params(self, depth = 1, breadth = 5):
+    def mdp_params(self, depth = 1, breadth = 5, pool = None, table = None, expanded = None,
+                   heuristic = 'dps', unique = False, beam_stats = None):
+        """
+        :param pool: optional multiprocessing pool that expands each layer of at least
+                     PARALLEL_MIN_BOARDS boards in parallel. Gives the same result as expanding serially
+        :param table: optional TranspositionTable, expands boards equal up to mirroring only once.
+                      Gives the same result as expanding every board
+        :param expanded: optional dict returned by an earlier search, whose expansions are reused
+        :param heuristic: passed on to select_beam
+        :param unique: keep each distinct result board once when selecting the next layer
+        :param beam_stats: optional list that a dict of counts is appended to for each layer
+        :return: dict of {state_key: {action: result_board}}
+        """
+        assert breadth > 0, f'Invalid breadth provided: {breadth}'
         boards = [self]
         s_a_r_dict = {}
         for i in range(depth):
-            next_boards = []
-            for b in boards:
-                s_a_r_dict[b.state_str()] = b.next_states()
-                next_b = [v for v in s_a_r_dict[b.state_str()].values()]
-                next_boards.extend(next_b)
-            boards = sorted(next_boards, key = Board.dps)[-breadth:]
+            with instrument.timer('expand'):
+                if expanded is not None:
+                    s_a_r_dict.update({b.key(): expanded[b.key()] for b in boards if b.key() in expanded})
+                # Small layers cost more to send to the pool than to expand here
+                if pool is not None and len(boards) >= Board.PARALLEL_MIN_BOARDS:
+                    self.expand_parallel([b for b in boards if b.key() not in s_a_r_dict], s_a_r_dict, pool, table)
+                for b in boards:
+                    if b.key() not in s_a_r_dict:
+                        s_a_r_dict[b.key()] = b.expand(table)
+            next_boards = [v for b in boards for v in s_a_r_dict[b.key()].values()]
+            if instrument.ENABLED: instrument.STATS.count('frontier_boards', len(next_boards))
+            layer = {'layer': i, 'expanded': len(boards), 'candidates': len(next_boards)}
+            # The last layer is never expanded, so nothing needs selecting from it
+            if i + 1 < depth:
+                with instrument.timer('select'):
+                    if unique:
+                        distinct = {}
+                        for b in next_boards:
+                            distinct.setdefault(b.key(), b)
+                        next_boards = list(distinct.values())
+                    layer['unique'] = len(next_boards)
+                    boards = Board.select_beam(next_boards, breadth, heuristic, layer)
+            if beam_stats is not None:
+                beam_stats.append(layer)
         return s_a_r_dict
     
+    @classmethod
+    def select_beam(cls, boards, breadth, heuristic = 'dps', stats = None):
+        """
+        Partial selection of the breadth boards with the highest score, later boards winning ties.
+        Same boards in the same order as sorting boards by score and keeping the last breadth
+        :param heuristic: one of HEURISTICS, or a function that takes in a board and returns its score
+        :param stats: optional dict that the number of kept boards is set in
+        :return: list of boards
+        """
+        if callable(heuristic):
+            score = heuristic
+        else:
+            assert heuristic in cls.HEURISTICS, f'Invalid heuristic provided: {heuristic}'
+            score = getattr(cls, cls.HEURISTICS[heuristic])
+        beam = []
+        for i, board in enumerate(boards):
+            if len(beam) < breadth:
+                heapq.heappush(beam, (score(board), i))
+            else:
+                heapq.heappushpop(beam, (score(board), i))
+        if stats is not None:
+            stats['kept'] = len(beam)
+        return [boards[i] for score, i in sorted(beam)]
+    
+    def merge_potential(self):
+        """
+        :return: dps plus PLACEHOLDER_DPS for every pair of dice that have a merge available
+        """
+        partners = {cell for merge in self.possible_merges() for cell in merge}
+        return self.dps() + Board.PLACEHOLDER_DPS * (len(partners) // 2)
+    
+    def moon_value(self):
+        """
+        :return: dps plus the speed up a PLACEHOLDER_DPS die would get on every empty cell
+        """
+        spd_ups = self.spd_ups()
+        return self.dps() + Board.PLACEHOLDER_DPS * sum(spd_ups[i] - 1 for i in self.empty_cells())
+    
+    def stochastic_params(self, depth = 1, breadth = 5, expanded = None, heuristic = 'dps', beam_stats = None):
+        """
+        Same search as mdp_params over stochastic_states, expanding the breadth distinct outcomes
+        with the highest heuristic score at each layer
+        :param expanded: optional dict returned by an earlier search, whose expansions are reused
+        :param heuristic: passed on to select_beam
+        :param beam_stats: optional list that a dict of counts is appended to for each layer
+        :return: dict of {state_key: {action: {result_key: (result_state, prob)}}}
+        """
+        boards = [self]
+        s_a_o_dict = {}
+        for i in range(depth):
+            with instrument.timer('expand'):
+                for b in boards:
+                    if b.key() in s_a_o_dict:
+                        continue
+                    if expanded is not None and b.key() in expanded:
+                        s_a_o_dict[b.key()] = expanded[b.key()]
+                    else:
+                        s_a_o_dict[b.key()] = b.stochastic_states()
+                        if instrument.ENABLED: instrument.STATS.count('states_expanded')
+            next_boards = list({key: board for b in boards for outcomes in s_a_o_dict[b.key()].values() \
+                                for key, (board, prob) in outcomes.items()}.values())
+            if instrument.ENABLED: instrument.STATS.count('frontier_boards', len(next_boards))
+            layer = {'layer': i, 'expanded': len(boards), 'candidates': len(next_boards)}
+            if i + 1 < depth:
+                with instrument.timer('select'):
+                    boards = Board.select_beam(next_boards, breadth, heuristic, layer)
+            if beam_stats is not None:
+                beam_stats.append(layer)
+        return s_a_o_dict
+    
+    def expand_parallel(self, boards, s_a_r_dict, pool, table = None):
+        """
+        Expands each distinct board once across the pool, adding {action: result_board} to s_a_r_dict
+        """
+        params = (self._deck, Board.PLACEHOLDER_DPS, Board.COMBO_COUNT)
+        if table is None:
+            unique = list({b.key(): b for b in boards}.values())
+            results = pool.map(expand_state, [(b.key(), params) for b in unique])
+            for b, result in zip(unique, results):
+                s_a_r_dict[b.key()] = b.orient(result)
+            if instrument.ENABLED: instrument.STATS.count('states_expanded', len(results))
+            return
+        pending = list({key: None for key, perm in [b.canonical() for b in boards] if key not in table})
+        results = pool.map(expand_state, [(key, params) for key in pending])
+        for key, result in zip(pending, results):
+            table.put(key, result)
+        if instrument.ENABLED: instrument.STATS.count('states_expanded', len(results))
+        for b in boards:
+            s_a_r_dict[b.key()] = b.expand(table)
+    
+    def expand(self, table = None):
+        """
+        :param table: optional TranspositionTable shared between searches
+        :return: same as next_states, expanding the canonical mirror of this board through table
+        """
+        if table is None:
+            if instrument.ENABLED: instrument.STATS.count('states_expanded')
+            return self.next_states()
+        key, perm = self.canonical()
+        result = table.get(key)
+        if result is None:
+            # Only boards missing from table are expanded, hits are counted by table itself
+            if instrument.ENABLED: instrument.STATS.count('states_expanded')
+            result = {action: r.key() for action, r in Board.from_key(key, self._deck).next_states().items()}
+            table.put(key, result)
+        return self.orient(result, perm)
+    
+    def orient(self, result, perm = None):
+        """
+        :param result: dict of {action: result_key} for this board mirrored by perm
+        :return: dict of {action: result_board} for this board, in next_states order
+        """
+        if perm is None or perm == Board.SYMMETRIES[0]:
+            return {action: Board.from_key(r_key, self._deck, self) for action, r_key in result.items()}
+        states = {Board.mirror_action(action, perm): \
+                  Board.from_key(Board.mirror_key(r_key, perm), self._deck, self) for action, r_key in result.items()}
+        return dict(sorted(states.items(), key = lambda item: Board.action_order(item[0])))
+    
+    def canonical(self):
+        """
+        :return: (key, perm) of the mirror of this board with the smallest key
+        """
+        return min((Board.mirror_key(self.key(), perm), perm) for perm in Board.SYMMETRIES)
+    
+    @classmethod
+    def mirror_key(cls, key, perm):
+        codes = key.to_bytes(cls.CELL_LIMIT, 'little')
+        return int.from_bytes(bytes(codes[p] for p in perm), 'little')
+    
+    @classmethod
+    def mirror_action(cls, action, perm):
+        tokens = action.split('_')
+        return '_'.join([tokens[0]] + [str(perm[int(cell) - 1] + 1) for cell in tokens[1:]])
+    
+    @classmethod
+    def action_order(cls, action):
+        """
+        :return: sort key reproducing next_states order, merges by (src, dest) then growths by cell
+        """
+        tokens = action.split('_')
+        return (tokens[0] != 'm', [int(cell) for cell in tokens[1:]])
+    
     def dice_dps(self, dice, cell, pip):
-        spd_up = self._spd_ups[cell]
-        if dice == Board.PLACEHOLDER_DICE:
-            return Board.PLACEHOLDER_DPS * pip * spd_up
-        if dice == Board.JOKER:
-            same_pip_die_unique = pd.Series([self._cells[j] for j in range(Board.CELL_LIMIT) \
-                                            if self.pip_at_cell(j) == pip]).unique()
-            return max([self.dice_dps(d, cell, pip) for d in self._deck if d != Board.JOKER])
-        mtd = Board.ALL_DICE[dice]['mtd']
-        spd = Board.ALL_DICE[dice]['atk_spd']
-        if dice == Board.COMBO:
-            return (mtd + Board.COMBO_COUNT * Board.COMBO_DPSPC) * pip * spd_up / spd
-        if dice == Board.GROWTH and pip < 7:
-            return Board.PLACEHOLDER_DPS * min(pip + 1, 7) * spd_up
-        return mtd * pip * spd_up / spd
+        return Board.dps_table(self._deck)[(Board.CELL_CODES[dice + str(pip)], self.spd_ups()[cell])]
     
     def dps(self):
-        if self.state_str() not in Board.CACHED_DPS.keys():
+        key = (Board.dps_params(self._deck), self.key())
+        dps = Board.CACHED_DPS.get(key)
+        if instrument.ENABLED: instrument.STATS.count('dps_cache_misses' if dps is None else 'dps_cache_hits')
+        if dps is None:
             dps = 0
+            table = Board.dps_table(self._deck)
+            spd_ups = self.spd_ups()
             for i in range(Board.CELL_LIMIT):
-                if self._cells[i] == Board.EMPTY:
-                    continue
-                    
-                dice = self._cells[i][:-1]
-                pip = int(self._cells[i][-1])
-                dps += self.dice_dps(dice, i, pip)
+                if self._codes[i] != 0:
+                    dps += table[(self._codes[i], spd_ups[i])]
                 
-            Board.CACHED_DPS[self.state_str()] = dps
+            Board.CACHED_DPS.put(key, dps)
             if DEBUG: print(f'Cached DPS for {self.state_str()}')
-            return dps
+        return dps
+    
+    def cell_dps(self, i, table = None):
+        code = self._codes[i]
+        if code == 0:
+            return 0
+        if table is None:
+            table = Board.dps_table(self._deck)
+        return table[(code, self.spd_ups()[i])]
+    
+    def dps_delta(self, parent = None, changed = None):
+        """
+        Recomputes only the cells whose dice or speed up changed
+        :param parent: board to compare against. Defaults to the board this one was derived from
+        :param changed: cells that differ from parent. Derived from the codes if None
+        :return: self.dps() - parent.dps()
+        """
+        if parent is None:
+            assert self._parent is not None, 'Board was not derived from a parent'
+            params = Board.dps_params(self._deck)
+            if self._dps_delta is None or self._dps_delta[0] != params:
+                self._dps_delta = (params, self.dps_delta(self._parent, self._changed))
+            return self._dps_delta[1]
+        if changed is None:
+            changed = [i for i in range(Board.CELL_LIMIT) if self._codes[i] != parent._codes[i]]
+        if self._parent is parent:
+            self.spd_ups()
+            cells = self._spd_changed.union(changed)
+        elif Board.moon_mode(self._num_moons) != Board.moon_mode(parent._num_moons):
+            cells = range(Board.CELL_LIMIT)
         else:
-            return Board.CACHED_DPS[self.state_str()]
+            cells = {j for c in changed if self.is_moon(c) or parent.is_moon(c) \
+                     for j in Board.adjacent_cells(c)}.union(changed)
+        table = Board.dps_table(self._deck)
+        return sum(self.cell_dps(i, table) - parent.cell_dps(i, table) for i in cells)
+    
+    def key(self):
+        """
+        :return: int packing every cell code into one byte, lossless w.r.t. state_str
+        """
+        if self._key is None:
+            self._key = int.from_bytes(self._codes, 'little')
+        return self._key
+    
+    def cells(self):
+        return [Board.CELL_STRS[code] for code in self._codes]
+    
+    def cell(self, i):
+        return Board.CELL_STRS[self._codes[i]]
     
     def state_str(self):
-        ret = ''
-        for cell in self._cells:
-            ret += str(cell) + ','
-        return ret[:-1]
+        return ','.join(self.cells())
     
     def next_states(self):
         """
@@ -172,28 +675,127 @@ class Board:
             
         # Growths
         growth_cells = [i for i in range(Board.CELL_LIMIT) \
-                        if self._cells[i][:-1] == Board.GROWTH and int(self._cells[i][-1]) != Board.PIP_LIMIT]
+                        if self.dice_at_cell(i) == Board.GROWTH and self.pip_at_cell(i) != Board.PIP_LIMIT]
         for cell in growth_cells:
-            new_pip = int(self._cells[cell][-1]) + 1
-            states[f'g_{cell + 1}'] = self.remove_dice(cell).spawn_dice(Board.PLACEHOLDER_DICE, cell, pip = new_pip)
+            new_pip = self.pip_at_cell(cell) + 1
+            states[f'g_{cell + 1}'] = self.replace_cells({cell: Board.PLACEHOLDER_DICE + str(new_pip)})
+        if instrument.ENABLED: instrument.STATS.count('actions_generated', len(states))
         return states
         
+    def stochastic_states(self):
+        """
+        :return: dict of {action: {result_key: (result_state, prob)}} with the placeholder of every
+                 next_states result drawn from the deck, and a SPAWN action while cells are empty
+        """
+        states = {action: self.outcomes(result) for action, result in self.next_states().items()}
+        if len(self.empty_cells()) > 0:
+            states[Board.SPAWN] = self.spawn_outcomes()
+        return states
+    
+    def outcomes(self, result):
+        """
+        :param result: board from next_states of this board
+        :return: dict of {result_key: (result_state, prob)} over the dice of the deck
+        """
+        counts = {}
+        for dice in self._deck:
+            board = self.realize(result, dice)
+            if board.key() not in counts:
+                counts[board.key()] = [board, 0]
+            counts[board.key()][1] += 1
+        return {key: (board, count / len(self._deck)) for key, (board, count) in counts.items()}
+    
+    def spawn_outcomes(self):
+        """
+        :return: dict of {result_key: (result_state, prob)} of a pip 1 die of the deck spawned
+                 on an empty cell
+        """
+        empty_cells = self.empty_cells()
+        counts = {}
+        for cell in empty_cells:
+            for dice in self._deck:
+                board = self.replace_cells({cell: dice + '1'})
+                if board.key() not in counts:
+                    counts[board.key()] = [board, 0]
+                counts[board.key()][1] += 1
+        total = len(empty_cells) * len(self._deck)
+        return {key: (board, count / total) for key, (board, count) in counts.items()}
+    
+    def realize(self, result, dice):
+        """
+        :param result: board from next_states of this board
+        :return: result with placeholder dice it added replaced by dice, derived from this board
+        """
+        changes = {}
+        for i in range(Board.CELL_LIMIT):
+            if result._codes[i] != self._codes[i]:
+                changes[i] = result.cell(i)
+                if result.dice_at_cell(i) == Board.PLACEHOLDER_DICE:
+                    changes[i] = dice + str(result.pip_at_cell(i))
+        return self.replace_cells(changes)
+        
     def possible_merges(self):
         """
-        :return: tuple representint src -> dest of possible merges
+        :return: tuple representint src -> dest of possible merges, in the same (src, dest) order
+                 as checking legal_merge on every permutation of occupied cells
         """
-        die_indices = [i for i in range(self.CELL_LIMIT) if self._cells[i] != self.EMPTY]
-        perms = list(it.permutations(die_indices, 2))
-        return [perm for perm in perms if self.legal_merge(perm[0], perm[1])]
+        buckets, wilds, pips = self.merge_index()
+        merges = set()
+        # Candidate (src, dest) pairs examined, each standing in for one legal_merge check
+        tested = 0
+        for code, cells in buckets.items():
+            if Board.PIP_OF_CODE[code] != Board.PIP_LIMIT:
+                merges.update(it.permutations(cells, 2))
+                tested += len(cells) * (len(cells) - 1)
+        # Jokers and mimics merge with any die of the same pip
+        for pip, wild_cells in wilds.items():
+            if pip == Board.PIP_LIMIT:
+                continue
+            for wild in wild_cells:
+                for cell in pips[pip]:
+                    if cell == wild:
+                        continue
+                    tested += 2
+                    if self._codes[cell] != self._codes[wild]:
+                        merges.add((wild, cell))
+                        merges.add((cell, wild))
+        if instrument.ENABLED: instrument.STATS.count('merges_tested', tested)
+        return sorted(merges)
+    
+    def merge_index(self):
+        """
+        :return: occupied cells bucketed as dicts of {cell_code: cells}, {pip: joker and mimic cells}
+                 and {pip: cells}
+        """
+        if self._merge_index is None:
+            buckets, wilds, pips = {}, {}, {}
+            for i, code in enumerate(self._codes):
+                if code == 0:
+                    continue
+                pip = Board.PIP_OF_CODE[code]
+                buckets.setdefault(code, []).append(i)
+                pips.setdefault(pip, []).append(i)
+                if Board.DICE_OF_CODE[code] == Board.JOKER or Board.DICE_OF_CODE[code] == Board.MIMIC:
+                    wilds.setdefault(pip, []).append(i)
+            self._merge_index = (buckets, wilds, pips)
+        return self._merge_index
             
     def empty_cells(self):
-        return [i for i in range(len(self._cells)) if self._cells[i] == self.EMPTY]
+        return [i for i in range(len(self._codes)) if self._codes[i] == 0]
+        
+    def replace_cells(self, changes):
+        """
+        :param changes: dict of {cell: cell_str} applied in a single step
+        :return: new board derived from this one
+        """
+        new_codes = bytearray(self._codes)
+        for cell, cell_str in changes.items():
+            new_codes[cell] = Board.CELL_CODES[cell_str]
+        return Board.from_codes(bytes(new_codes), self._deck, self, tuple(changes))
         
     def remove_dice(self, cell):
         assert cell not in self.empty_cells(), f'Non-empty cell provided: {cell}'
-        new_cells = self._cells.copy()
-        new_cells[cell] = Board.EMPTY
-        return Board(new_cells, self._deck)
+        return self.replace_cells({cell: Board.EMPTY})
         
     def spawn_dice(self, dice, spawn_cell, pip = 1):
         empty_cells = self.empty_cells()
@@ -201,29 +803,27 @@ class Board:
         assert spawn_cell >= 0 and spawn_cell < self.CELL_LIMIT, f'Spawn loc out of range: {spawn_cell}'
         assert pip >= 1 and pip <= 7, f'Invalid pip provided: {pip}'
         assert spawn_cell in empty_cells, f'Spawn loc already has dice: {spawn_cell}'
-        new_cells = self._cells.copy()
-        new_cells[spawn_cell] = dice + str(pip)
-        return Board(new_cells, self._deck)
+        return self.replace_cells({spawn_cell: dice + str(pip)})
     
     def mimic_or_joker(self, src, dest):
-        mimic = self._cells[src][:-1] == Board.MIMIC or self._cells[dest][:-1] == Board.MIMIC
-        joker = self._cells[src][:-1] == Board.JOKER or self._cells[dest][:-1] == Board.JOKER
+        mimic = self.dice_at_cell(src) == Board.MIMIC or self.dice_at_cell(dest) == Board.MIMIC
+        joker = self.dice_at_cell(src) == Board.JOKER or self.dice_at_cell(dest) == Board.JOKER
         return mimic or joker
     
     def legal_merge(self, src, dest):
         if not (src >= 0 and src < Board.CELL_LIMIT and dest >= 0 and dest < Board.CELL_LIMIT):
             if DEBUG: print(f'Merge locs out of range: {src} -> {dest}')
             return False
-        if not (self._cells[src] != Board.EMPTY and self._cells[dest] != Board.EMPTY):
+        if not (self._codes[src] != 0 and self._codes[dest] != 0):
             if DEBUG: print(f'Merge locs contain empty cell: {src} -> {dest}')
-        if self._cells[src][:-1] != self._cells[dest][:-1]:
+        if self.dice_at_cell(src) != self.dice_at_cell(dest):
             if not (self.mimic_or_joker(src, dest)):
                 if DEBUG: print(f'Merge locs contain different die: {src} -> {dest}')
                 return False
-        if self._cells[src][-1] != self._cells[dest][-1]:
+        if self.pip_at_cell(src) != self.pip_at_cell(dest):
             if DEBUG: print(f'Merge locs contain different pips: {src} -> {dest}')
             return False
-        if int(self._cells[src][-1]) == Board.PIP_LIMIT:
+        if self.pip_at_cell(src) == Board.PIP_LIMIT:
             if DEBUG: print(f'Unable to merge max pips: {src} -> {dest}')
             return False
         return True
@@ -234,87 +834,91 @@ class Board:
         :return: merge outcome with placeholder dice in dest
         """
         assert self.legal_merge(src, dest), f'Illegal merge'
-        if self._cells[src][:-1] == Board.JOKER:
-            dest_dice = self._cells[dest][:-1]
-            dest_pip = int(self._cells[dest][-1])
-            return self.remove_dice(src).spawn_dice(dest_dice, src, pip = dest_pip)
+        if self.dice_at_cell(src) == Board.JOKER:
+            return self.replace_cells({src: self.cell(dest)})
         else:
+            assert dice in self._deck + [Board.PLACEHOLDER_DICE], f'Invalid dice provided: {dice}'
             if dice != Board.PLACEHOLDER_DICE and \
-                (self._cells[src][:-1] == Board.COMBO or self._cells[src][:-1] == Board.COMBO):
+                (self.dice_at_cell(src) == Board.COMBO or self.dice_at_cell(src) == Board.COMBO):
                 Board.COMBO_COUNT += 1
-            new_pip = int(self._cells[dest][-1]) + 1
-            return self.remove_dice(src).remove_dice(dest).spawn_dice(dice, dest, pip = new_pip)
+            new_pip = self.pip_at_cell(dest) + 1
+            return self.replace_cells({src: Board.EMPTY, dest: dice + str(new_pip)})
     
     def dice_at_cell(self, cell):
-        return self._cells[cell][:-1]
+        return Board.DICE_OF_CODE[self._codes[cell]]
     
     def pip_at_cell(self, cell):
-        return int(self._cells[cell][-1])
+        return Board.PIP_OF_CODE[self._codes[cell]]
     
     def __eq__(self, other):
         if isinstance(other, Board):
-            return self.state_str() == other.state_str()
+            return self.key() == other.key()
         return False
     
     def __hash__(self):
-        return self.state_str().__hash__()
+        return self.key().__hash__()
 
-    @deprecation.deprecated()
-    def smart_empty_cells(self):
-        return [i for i in range(len(self._cells)) \
-                if self._cells[i] == self.EMPTY and i > self._largest_filled_cell]
+    def mirror(self, perm):
+        return Board.from_codes(bytes(self._codes[p] for p in perm), self._deck)
 
-    @deprecation.deprecated()
     def v_mirror(self):
         """
         :return: Reflection of board when a mirror is placed vertically. LR reflection
         """
-        return Board(self._cells[4::-1] + self._cells[9:4:-1] + self._cells[14:9:-1], self._deck)
+        return self.mirror(Board.SYMMETRIES[1])
     
-    @deprecation.deprecated()
     def h_mirror(self):
         """
         :return: Reflection of board when a mirror is placed horizontally. TD reflection
         """
-        return Board(self._cells[10:] + self._cells[5:10] + self._cells[:5], self._deck)
+        return self.mirror(Board.SYMMETRIES[2])
     
-    @deprecation.deprecated()
     def symmetrical(self):
         return self.v_mirror() == self or self.h_mirror() == self
     
     @classmethod
-    @deprecation.deprecated()
     def remove_symmetry(cls, boards):
-        remove_identical = list(pd.Series(boards).unique())
-        result = [b for b in remove_identical if not b.symmetrical()]
-        return result
+        """
+        :return: first board of each class of boards equal up to mirroring
+        """
+        unique = {}
+        for b in boards:
+            unique.setdefault(b.canonical()[0], b)
+        return list(unique.values())
     
     @classmethod
-    @deprecation.deprecated()
-    def get_states(cls, deck):
-        """
-        Deprecated. Takes too long to run
-        :return: list of str representation of ALL possible board states from provided deck
-        """
-        states = {num: None for num in range(1, cls.CELL_LIMIT + 1)}
-        print('Initializing 1-dice boards..', end = '')
-        lonely_states = []
-        for dice in deck:
-            for cell in range(cls.CELL_LIMIT):
-                for pip in range(1, cls.PIP_LIMIT + 1):
-                    lonely_states.append(Board.new_board(deck).spawn_dice(dice, cell, pip))
-        states[1] = lonely_states
-        
-        print('Done')
-        for num_die in range(2, cls.CELL_LIMIT + 1):
-            print(f'Generating boards with {num_die} die..', end = '')
-            curr_states = []
-            for prev_state in states[num_die - 1]:
-                empty_cells = prev_state.smart_empty_cells()
-                for cell in empty_cells:
-                    for dice in deck:
-                        for pip in range(1, cls.PIP_LIMIT + 1):
-                            curr_states.append(prev_state.spawn_dice(dice, cell, pip))
-            states[num_die] = curr_states
-            print('Done')
-        return states
\ No newline at end of file
+    def reachable_states(cls, deck, max_fill = CELL_LIMIT, max_pip = PIP_LIMIT):
+        """
+        Streams every board of dice from deck with 1 to max_fill dice of up to max_pip pips, fewest
+        dice first and one board per class of boards equal up to mirroring. Only the canonical keys
+        of the last fill level are kept in memory
+        :return: generator of canonical boards
+        """
+        codes = [cls.CELL_CODES[dice + str(pip)] for dice in deck for pip in range(1, max_pip + 1)]
+        level = [0]
+        for fill in range(max_fill):
+            seen = set()
+            for key in level:
+                for cell, code in enumerate(key.to_bytes(cls.CELL_LIMIT, 'little')):
+                    if code != 0:
+                        continue
+                    for new_code in codes:
+                        child = key | new_code << (8 * cell)
+                        canonical = min(cls.mirror_key(child, perm) for perm in cls.SYMMETRIES)
+                        if canonical not in seen:
+                            seen.add(canonical)
+                            yield cls.from_key(canonical, deck)
+            level = sorted(seen)
+
+Board.build_static_tables()
+
+def expand_state(args):
+    """
+    Worker for Board.expand_parallel
+    :param args: (state_key, (deck, placeholder_dps, combo_count))
+    :return: dict of {action: result_key}
+    """
+    key, (deck, placeholder_dps, combo_count) = args
+    Board.PLACEHOLDER_DPS = placeholder_dps
+    Board.COMBO_COUNT = combo_count
+    return {action: result.key() for action, result in Board.from_key(key, deck).next_states().items()}
@@ -0,0 +1,102 @@
+from collections import OrderedDict
+
+class LRUCache:
+    
+    def __init__(self, maxsize = 2 ** 16):
+        """
+        :param maxsize: max number of entries kept before the least recently used is evicted
+        """
+        assert maxsize > 0, f'Invalid maxsize provided: {maxsize}'
+        self._maxsize = maxsize
+        self._data = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        
+    def get(self, key, default = None):
+        if key in self._data:
+            self._hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+        self._misses += 1
+        return default
+    
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        self._evict()
+            
+    def _evict(self):
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last = False)
+            self._evictions += 1
+    
+    def resize(self, maxsize):
+        assert maxsize > 0, f'Invalid maxsize provided: {maxsize}'
+        self._maxsize = maxsize
+        self._evict()
+    
+    def invalidate(self, predicate = None):
+        """
+        :param predicate: function that takes in a key and returns True if it should be dropped.
+                          Drops every entry if None
+        :return: number of entries dropped
+        """
+        if predicate is None:
+            dropped = len(self._data)
+            self._data.clear()
+            return dropped
+        stale = [key for key in self._data if predicate(key)]
+        for key in stale:
+            del self._data[key]
+        return len(stale)
+    
+    def reset_stats(self):
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+    
+    def stats(self):
+        return {
+            'hits': self._hits,
+            'misses': self._misses,
+            'evictions': self._evictions,
+            'size': len(self._data),
+            'maxsize': self._maxsize
+        }
+    
+    def items(self):
+        """
+        :return: list of (key, value) from least to most recently used, without touching either
+        """
+        return list(self._data.items())
+    
+    def __contains__(self, key):
+        return key in self._data
+    
+    def __len__(self):
+        return len(self._data)
+
+class TranspositionTable(LRUCache):
+    """
+    Maps canonical state keys to their expansion {action: result_key} so that boards equal up to
+    symmetry are only expanded once
+    """
+    
+    def __init__(self, maxsize = 2 ** 16):
+        super().__init__(maxsize)
+        self._expansions = 0
+        
+    def put(self, key, value):
+        self._expansions += 1
+        super().put(key, value)
+        
+    def reset_stats(self):
+        super().reset_stats()
+        self._expansions = 0
+        
+    def stats(self):
+        stats = super().stats()
+        stats['expansions'] = self._expansions
+        stats['saved'] = self._hits + self._misses - self._expansions
+        return stats
@@ -0,0 +1,56 @@
+import os
+import csv
+import pickle
+import hashlib
+from collections import namedtuple
+
+DICE_PATH = os.environ.get('MDP_DICE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'all_dice.txt'))
+
+Dice = namedtuple('Dice', ['id', 'name', 'class_lvl', 'mtd', 'atk_spd'])
+
+_CATALOGS = {}
+
+def load(path = None):
+    """
+    Parses the dice catalog on first use. The parsed table is also pickled into __pycache__ next
+    to the catalog, and reused while the catalog's size and mtime are unchanged
+    :param path: csv of id,name,class,max_total_damage,atk_spd. Defaults to DICE_PATH
+    :return: dict of {id: Dice}
+    """
+    path = os.path.abspath(path or DICE_PATH)
+    if path not in _CATALOGS:
+        stat = os.stat(path)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        compiled = os.path.join(os.path.dirname(path), '__pycache__', os.path.basename(path) + '.pickle')
+        dice = None
+        try:
+            with open(compiled, 'rb') as f:
+                compiled_stamp, compiled_dice = pickle.load(f)
+            # Checked explicitly rather than asserted, so python -O never serves a stale catalog
+            if compiled_stamp == stamp:
+                dice = compiled_dice
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            pass
+        if dice is None:
+            dice = parse(path)
+            try:
+                os.makedirs(os.path.dirname(compiled), exist_ok = True)
+                with open(compiled, 'wb') as f:
+                    pickle.dump((stamp, dice), f)
+            except OSError:
+                pass
+        _CATALOGS[path] = dice
+    return _CATALOGS[path]
+
+def parse(path):
+    with open(path, newline = '') as f:
+        rows = csv.DictReader(f)
+        return {row['id']: Dice(row['id'], row['name'], int(row['class']), int(row['max_total_damage']), \
+                                float(row['atk_spd'])) for row in rows}
+
+def version(path = None):
+    """
+    :return: hex digest of the catalog contents, changes whenever any die stat does
+    """
+    with open(os.path.abspath(path or DICE_PATH), 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
@@ -0,0 +1,72 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+# Call sites check ENABLED before touching STATS, so instrumentation costs nothing when off
+ENABLED = False
+
+class Stats:
+    
+    def __init__(self):
+        self.reset()
+        
+    def reset(self):
+        self.counts = {}
+        self.times = {}
+        self.values = {}
+    
+    def count(self, name, n = 1):
+        self.counts[name] = self.counts.get(name, 0) + n
+        
+    def add_time(self, name, seconds):
+        self.times[name] = self.times.get(name, 0) + seconds
+        
+    def observe(self, name, value):
+        """
+        Records the last and max of a sampled value such as a residual
+        """
+        last, peak = self.values.get(name, (value, value))
+        self.values[name] = (value, max(peak, value))
+    
+    def snapshot(self):
+        return {
+            'counts': dict(self.counts),
+            'times': dict(self.times),
+            'values': {name: {'last': last, 'max': peak} for name, (last, peak) in self.values.items()}
+        }
+    
+    def summary(self):
+        lines = [f'{name}: {time_spent * 1e3:.1f}ms' for name, time_spent in self.times.items()]
+        lines += [f'{name}: {n}' for name, n in self.counts.items()]
+        lines += [f'{name}: last {last:.3g}, max {peak:.3g}' for name, (last, peak) in self.values.items()]
+        return '\n'.join(lines)
+
+STATS = Stats()
+
+@contextmanager
+def collect(stats):
+    """
+    Sends everything recorded inside the block to stats instead of STATS
+    """
+    global STATS
+    previous = STATS
+    STATS = stats
+    try:
+        yield stats
+    finally:
+        STATS = previous
+
+@contextmanager
+def _timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STATS.add_time(name, time.perf_counter() - start)
+
+def timer(name):
+    """
+    :return: context manager adding the time spent inside it to STATS under name, no-op if disabled
+    """
+    if not ENABLED:
+        return nullcontext()
+    return _timer(name)
@@ -1,9 +1,29 @@
-import mdp
-import pandas as pd
+import instrument
+import multiprocessing as mp
 from board import Board
+from cache import TranspositionTable
+from mcts import MCTSPlanner
+from planner import Planner
+from store import Store
+from policy import PolicyTable
 
 depth = 3
 breadth = 10
+solver = 'dict'
+processes = None
+transpositions = False
+stats = False
+stochastic = False
+# Beam score of Board.HEURISTICS, and whether to keep each distinct board once in the beam
+heuristic = 'dps'
+unique = False
+horizon = 8
+rollouts = None
+time_limit = None
+# SQLite file that DPS values and solved boards persist to between sessions
+store_path = None
+# Table written by policy.compile_table, looked up before any search
+policy_path = None
 
 def spawn(board, dice, index, pip = 1):
     try:
@@ -63,51 +83,64 @@ def process_command(comd, board):
     print('Unknown command received')
     return board, True
 
-def mdp_params(board):
-    s_a_r_dict = board.mdp_params(depth, breadth)
-    state_strings = []
-    actions = []
-    trans_probs = []
-
-    for state, action_dict in s_a_r_dict.items():
-        state_strings.append(state)
-        for action, result in action_dict.items():
-            state_strings.append(result.state_str())
-            actions.append(action)
-            trans_probs.append([state, action, result.state_str(), 1 / Board.DECK_LIMIT])
-
-    state_strings = list(set(state_strings))
-    actions = list(set(actions))
-    
-    return state_strings, actions, trans_probs
-
 def run():
     
     deck = ['c', 'j', 'o', 'g', 'm']
-    board = Board.new_board(deck)
+    store = Store(store_path, dice_path = Board.DICE_PATH) if store_path else None
+    board = Board.new_board(deck, store)
+    policy = PolicyTable(policy_path) if policy_path else None
     print(f'Initialized empty Board with deck: {deck}')
     print(board)
-    
-    def reward_func(state, action, result_state):
-        return Board.parse_state_str(result_state, deck).dps() - Board.parse_state_str(state, deck).dps()
+    pool = mp.Pool(processes) if processes else None
+    table = TranspositionTable() if transpositions else None
+    planner = Planner(deck, depth, breadth, 0.5, solver, pool, table, stochastic, heuristic, unique)
+    sampler = MCTSPlanner(deck, horizon, 0.5, processes = processes, pool = pool) if rollouts or time_limit else None
+    instrument.ENABLED = stats
     
     while True:
         
         prompt(deck)
                 
-        try:
-            states, actions, trans_probs = mdp_params(board)
-            model = mdp.MDP(states, actions, trans_probs, reward_func, 0.5)
-            pi_star = model.pi_stars[board.state_str()]
-            print(f'Optimal step with depth {depth} and breadth {breadth}: {pi_star}')
-        except:
-            print(f'No optimal step here')
+        entry = policy.lookup(board) if policy and policy.matches(deck) else None
+        # Everything besides the board that the stored solve depends on
+        params = (Board.dps_params(deck), depth, breadth, 0.5, solver, stochastic, heuristic, unique)
+        solved = store.get_solved(params, board.key()) if store and not entry else None
+        if entry is not None:
+            print(f'Table optimal step with depth {policy.header["depth"]} and breadth {policy.header["breadth"]}: '
+                  f'{entry[0]}')
+        elif solved is not None:
+            print(f'Stored optimal step with depth {depth} and breadth {breadth}: {solved[1]}')
+        else:
+            try:
+                planner.stats.reset()
+                model = planner.plan(board)
+                pi_star = model.pi_stars[board.key()]
+                print(f'Optimal step with depth {depth} and breadth {breadth}: {pi_star}')
+                if store:
+                    store.put_solved(params, board.key(), model.v_stars[board.key()], pi_star)
+            except:
+                print(f'No optimal step here')
+        if sampler is not None:
+            result = sampler.search(board, rollouts, time_limit)
+            print(f'Sampled step with horizon {horizon} over {result["rollouts"]} rollouts: {result["action"]} '
+                  f'({result["mean"]:.1f} +/- {1.96 * result["stderr"]:.1f})')
+        if stats:
+            print(planner.stats.summary())
+            for layer in planner.beam_stats:
+                print(f'Beam: {layer}')
+            if table is not None:
+                print(f'Transpositions: {table.stats()}')
         
         command = input('Next command:\n')
         board, cont = process_command(command, board)
         
         if not cont:
             print('Bye!')
+            if pool is not None:
+                pool.close()
+            if store is not None:
+                Board.save_dps_cache(store, deck)
+                store.close()
             break
             
         print(board)
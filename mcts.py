@@ -0,0 +1,164 @@
+import math
+import time
+import random
+import multiprocessing as mp
+from board import Board
+
+class MCTSPlanner:
+    
+    def __init__(self, deck, horizon = 8, gamma = 0.5, c = math.sqrt(2), processes = None, seed = None, pool = None):
+        """
+        UCT search over Board.next_states where every placeholder outcome is sampled as a real die
+        from the deck, so the horizon is not limited by the branching of spawns
+        :param horizon: number of steps simulated from the root
+        :param c: exploration constant, scaled by the largest return seen
+        :param processes: number of independent trees searched in parallel and merged at the root
+        :param pool: multiprocessing pool the trees are searched on, one of processes workers is
+                     created and kept until close if processes is given without a pool
+        """
+        self._deck = deck
+        self._horizon = horizon
+        self._gamma = gamma
+        self._c = c
+        self._processes = processes
+        self._owns_pool = pool is None and bool(processes)
+        self._pool = mp.Pool(processes) if self._owns_pool else pool
+        self._rng = random.Random(seed)
+        self._tree = {}
+        self._scale = 1
+        
+    def search(self, board, rollouts = None, time_limit = None):
+        """
+        Stops after rollouts simulations or time_limit seconds, whichever comes first. Every search
+        grows a new tree, so stats never carry over from other boards or DPS params
+        :return: dict of the best action at the root, its mean return and standard error, and
+                 {action: {visits, mean, stderr}} over every root action
+        """
+        assert rollouts is not None or time_limit is not None, 'No rollout or time budget provided'
+        if not self._processes:
+            return MCTSPlanner.summarize(self.run(board, rollouts, time_limit), rollouts)
+        params = (self._deck, Board.PLACEHOLDER_DPS, Board.COMBO_COUNT)
+        config = (self._horizon, self._gamma, self._c)
+        shares = [None] * self._processes
+        if rollouts is not None:
+            shares = [rollouts // self._processes + (i < rollouts % self._processes) for i in range(self._processes)]
+        tasks = [(board.key(), params, config, self._rng.getrandbits(32), share, time_limit) for share in shares]
+        results = self._pool.map(search_tree, tasks)
+        merged = {}
+        for root in results:
+            for action, stats in root.items():
+                merged[action] = [total + n for total, n in zip(merged.get(action, [0, 0, 0]), stats)]
+        return MCTSPlanner.summarize(merged, rollouts)
+    
+    def run(self, board, rollouts = None, time_limit = None):
+        """
+        :return: dict of {action: [visits, sum of returns, sum of squared returns]} at the root
+        """
+        self._tree = {}
+        self._scale = 1
+        deadline = None if time_limit is None else time.time() + time_limit
+        done = 0
+        while (rollouts is None or done < rollouts) and (deadline is None or time.time() < deadline):
+            self.simulate(board, self._horizon)
+            done += 1
+        root = self._tree.get((board.key(), self._horizon))
+        return {} if root is None else root['stats']
+    
+    @classmethod
+    def summarize(cls, root, rollouts):
+        actions = {}
+        for action, (n, total, total_sq) in root.items():
+            # Budgets smaller than the number of actions leave some never tried
+            if n == 0:
+                continue
+            mean = total / n
+            var = max(total_sq / n - mean ** 2, 0)
+            actions[action] = {'visits': n, 'mean': mean, 'stderr': math.sqrt(var / n)}
+        if len(actions) == 0:
+            return {'action': None, 'mean': 0, 'stderr': 0, 'rollouts': 0, 'actions': actions}
+        best = max(actions, key = lambda action: (actions[action]['visits'], actions[action]['mean']))
+        return {
+            'action': best,
+            'mean': actions[best]['mean'],
+            'stderr': actions[best]['stderr'],
+            'rollouts': sum(stats['visits'] for stats in actions.values()),
+            'actions': actions
+        }
+    
+    def sample(self, board, result):
+        """
+        :param result: board from board.next_states()
+        :return: result with its placeholder drawn from the deck, derived from board
+        """
+        return board.realize(result, self._rng.choice(self._deck))
+    
+    def simulate(self, board, depth):
+        """
+        One UCT descent from board, expanding a single node and rolling out randomly below it
+        :return: discounted return from board
+        """
+        if depth == 0:
+            return 0
+        node = self._tree.get((board.key(), depth))
+        if node is None:
+            states = board.next_states()
+            node = {'n': 0, 'stats': {action: [0, 0, 0] for action in states}}
+            self._tree[(board.key(), depth)] = node
+            if len(states) == 0:
+                return 0
+            # The first step of the rollout is recorded, so every simulation counts at the new node
+            action = self._rng.choice(list(states))
+            outcome = self.sample(board, states[action])
+            ret = outcome.dps_delta() + self._gamma * self.rollout(outcome, depth - 1)
+        elif len(node['stats']) == 0:
+            return 0
+        else:
+            action = self.select(node)
+            outcome = self.sample(board, board.next_states()[action])
+            ret = outcome.dps_delta() + self._gamma * self.simulate(outcome, depth - 1)
+        self._scale = max(self._scale, abs(ret))
+        node['n'] += 1
+        stats = node['stats'][action]
+        stats[0] += 1
+        stats[1] += ret
+        stats[2] += ret ** 2
+        return ret
+    
+    def close(self):
+        if self._owns_pool:
+            self._pool.close()
+    
+    def select(self, node):
+        untried = [action for action, stats in node['stats'].items() if stats[0] == 0]
+        if len(untried) > 0:
+            return self._rng.choice(untried)
+        log_n = math.log(node['n'])
+        return max(node['stats'], key = lambda action: node['stats'][action][1] / node['stats'][action][0] \
+                   + self._c * self._scale * math.sqrt(log_n / node['stats'][action][0]))
+    
+    def rollout(self, board, depth, states = None):
+        ret = 0
+        discount = 1
+        for i in range(depth):
+            if states is None:
+                states = board.next_states()
+            if len(states) == 0:
+                break
+            outcome = self.sample(board, states[self._rng.choice(list(states))])
+            ret += discount * outcome.dps_delta()
+            discount *= self._gamma
+            board = outcome
+            states = None
+        return ret
+
+def search_tree(args):
+    """
+    Worker for MCTSPlanner.search, grows one independent tree
+    :param args: (state_key, (deck, placeholder_dps, combo_count), (horizon, gamma, c), seed, rollouts, time_limit)
+    :return: root stats of MCTSPlanner.run
+    """
+    key, (deck, placeholder_dps, combo_count), (horizon, gamma, c), seed, rollouts, time_limit = args
+    Board.PLACEHOLDER_DPS = placeholder_dps
+    Board.COMBO_COUNT = combo_count
+    planner = MCTSPlanner(deck, horizon, gamma, c, seed = seed)
+    return planner.run(Board.from_key(key, deck), rollouts, time_limit)
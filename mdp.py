@@ -1,72 +1,323 @@
+import heapq
+import instrument
+
 DEBUG = False
 
 class Transition:
     
     def __init__(self, states, actions):
-        self._states = states
-        self._actions = actions
+        """
+        Rows of each (state, action) are stored as a tuple of result states and a tuple of their
+        probs, with equal probs tuples shared between rows
+        """
+        self._states = set(states)
+        self._actions = set(actions)
         self._probs = {}
+        self._vectors = {}
         
     def add_prob(self, state, action, r_state, prob):
+        """
+        Adds prob to any prob already added for r_state
+        """
         assert state in self._states, f'Invalid state provided: {state}'
         assert action in self._actions, f'Invalid action provided: {action}'
         assert r_state in self._states, f'Invalid state provided: {r_state}'
         assert prob >= 0 and prob <= 1, f'Invalid prob provided: {prob}'
-        if state not in self._probs.keys():
-            self._probs[state] = {action: {} for action in self._actions}
-        if r_state not in self._probs[state][action].keys():
-            self._probs[state][action] = {}
-        self._probs[state][action][r_state] = prob
+        r_states, probs = self.get_row(state, action)
+        if r_state in r_states:
+            i = r_states.index(r_state)
+            probs = probs[:i] + (probs[i] + prob,) + probs[i + 1:]
+        else:
+            r_states, probs = r_states + (r_state,), probs + (prob,)
+        self._probs.setdefault(state, {})[action] = (r_states, self._vectors.setdefault(probs, probs))
+        
+    def add_outcomes(self, state, action, r_states, probs):
+        """
+        Sets the whole row of (state, action) at once
+        :param r_states: tuple of distinct result states
+        :param probs: tuple of the prob of each result state
+        """
+        assert state in self._states, f'Invalid state provided: {state}'
+        assert action in self._actions, f'Invalid action provided: {action}'
+        assert len(r_states) == len(probs), f'Got {len(probs)} probs for {len(r_states)} states'
+        for r_state, prob in zip(r_states, probs):
+            assert r_state in self._states, f'Invalid state provided: {r_state}'
+            assert prob >= 0 and prob <= 1, f'Invalid prob provided: {prob}'
+        self._probs.setdefault(state, {})[action] = (tuple(r_states), self._vectors.setdefault(probs, probs))
+        
+    def validate(self, thres = 10 ** -9):
+        """
+        Asserts the probs of every non empty row sum to 1
+        """
+        for state, rows in self._probs.items():
+            for action, (r_states, probs) in rows.items():
+                total = sum(probs)
+                assert len(r_states) == 0 or abs(total - 1) < thres, \
+                    f'Probs of {action} from {state} sum to {total}'
+            
+    def get_row(self, state, action):
+        return self._probs.get(state, {}).get(action, ((), ()))
             
     def get_prob(self, state, action, r_state):
-        return self._probs[state][action][r_state]
+        r_states, probs = self.get_row(state, action)
+        return probs[r_states.index(r_state)] if r_state in r_states else 0
     
     def get_from_states(self):
         return self._probs.keys()
     
     def get_result_states(self, state, action):
-        return self._probs[state][action].keys()
+        return self.get_row(state, action)[0]
+    
+    def get_outcomes(self, state, action):
+        """
+        :return: iterable of (result_state, prob)
+        """
+        return zip(*self.get_row(state, action))
+    
+    @property
+    def num_vectors(self):
+        """
+        :return: number of distinct probs tuples shared between rows
+        """
+        return len(self._vectors)
         
 class MDP:
     
-    def __init__(self, states, actions, trans_probs, reward_func, gamma):
+    SOLVERS = {
+        'dict': 'compute_q_stars',
+        'numpy': 'compute_q_stars_numpy',
+        'prioritized': 'compute_q_stars_prioritized',
+        'backward': 'compute_q_stars_backward'
+    }
+    
+    def __init__(self, states, actions, trans_probs, reward_func, gamma, solver = 'dict', q_init = None):
         """
         :param states: list of possible states
         :param actions: list of possible actions
-        :param trans_probs: list of list of [state, action, result_state, prob]
+        :param trans_probs: list of list of [state, action, result_state, prob], or a Transition
+                            built over states and actions whose probs are validated
         :param reward_func: function that takes in (state, action, result_state) and returns a number
+        :param solver: one of MDP.SOLVERS used to compute q stars
+        :param q_init: optional dict of {state: {action: q}} that iterative solvers start from
         """
+        assert solver in MDP.SOLVERS, f'Invalid solver provided: {solver}'
         self._states = states
         self._actions = actions
-        self._trans_probs = Transition(states, actions)
-        for trans_prob in trans_probs:
-            self._trans_probs.add_prob(trans_prob[0], trans_prob[1], trans_prob[2], trans_prob[3])
+        if isinstance(trans_probs, Transition):
+            trans_probs.validate()
+            self._trans_probs = trans_probs
+        else:
+            self._trans_probs = Transition(states, actions)
+            for trans_prob in trans_probs:
+                self._trans_probs.add_prob(trans_prob[0], trans_prob[1], trans_prob[2], trans_prob[3])
         self._reward_func = reward_func
-        self._q_stars = self.compute_q_stars(gamma)
+        self._q_init = q_init if q_init is not None else {}
+        self._solver_stats = {'sweeps': 0, 'backups': 0}
+        with instrument.timer('solve'):
+            self._q_stars = getattr(self, MDP.SOLVERS[solver])(gamma)
+        if instrument.ENABLED:
+            instrument.STATS.count('vi_sweeps', self._solver_stats['sweeps'])
+            instrument.STATS.count('vi_backups', self._solver_stats['backups'])
         self._v_stars = self.compute_v_stars()
         self._pi_stars = self.compute_pi_stars()
             
-    def compute_q_stars(self, gamma, thres = 10 ** -4):
+    def initial_q_stars(self):
+        """
+        :return: q_init for states with transitions, 0 everywhere else
+        """
         q_stars = {state: {action: 0 for action in self._actions} for state in self._states}
+        from_states = self._trans_probs.get_from_states()
+        for state, q_init in self._q_init.items():
+            if state in q_stars and state in from_states:
+                q_stars[state].update({action: q for action, q in q_init.items() if action in q_stars[state]})
+        return q_stars
+    
+    def compute_q_stars(self, gamma, thres = 10 ** -4):
+        q_stars = self.initial_q_stars()
         while True:
             q_stars_copy = {state: {action: q_stars[state][action] for action in self._actions} for state in self._states}
+            v_stars = {state: max(q_stars[state].values(), default = 0) for state in self._states}
             q_diffs = []
+            self._solver_stats['sweeps'] += 1
             for state in self._trans_probs.get_from_states():
                 if DEBUG: print('.', end = '')
+                self._solver_stats['backups'] += 1
                 for action in self._actions:
                     q_star = 0
-                    for r_state in self._trans_probs.get_result_states(state, action):
-                        trans_prob = self._trans_probs.get_prob(state, action, r_state)
+                    for r_state, trans_prob in self._trans_probs.get_outcomes(state, action):
                         reward = self._reward_func(state, action, r_state)
-                        max_q_star_next = q_stars_copy[r_state][max(q_stars_copy[r_state], key = q_stars_copy[r_state].get)]
+                        # Self loops see the actions of state already backed up in this sweep
+                        max_q_star_next = max(q_stars_copy[state].values()) if r_state == state else v_stars[r_state]
                         q_star += trans_prob * (reward + gamma * max_q_star_next)
                     q_stars_copy[state][action] = q_star
                     q_diffs.append(abs(q_star - q_stars[state][action]))
+                v_stars[state] = max(q_stars_copy[state].values(), default = 0)
             q_stars = q_stars_copy
+            if instrument.ENABLED: instrument.STATS.observe('vi_residual', max(q_diffs, default = 0))
             if all(diff < thres for diff in q_diffs):
                 if DEBUG: print('Threshold attained for q stars, exiting..')
                 return q_stars
     
+    def compute_q_stars_numpy(self, gamma, thres = 10 ** -4):
+        """
+        Same fixed point as compute_q_stars, with states and actions indexed once and transitions
+        stored as CSR arrays so each sweep is a batch of array operations
+        """
+        # Only imported by this solver, so the others do not pay for loading numpy
+        import numpy as np
+        state_ids = {state: i for i, state in enumerate(self._states)}
+        action_ids = {action: i for i, action in enumerate(self._actions)}
+        num_states, num_actions = len(self._states), len(self._actions)
+        
+        rows, indptr, indices, probs, rewards = [], [0], [], [], []
+        for state in self._trans_probs.get_from_states():
+            for action in self._actions:
+                for r_state, trans_prob in self._trans_probs.get_outcomes(state, action):
+                    indices.append(state_ids[r_state])
+                    probs.append(trans_prob)
+                    rewards.append(self._reward_func(state, action, r_state))
+                indptr.append(len(indices))
+                rows.append(state_ids[state] * num_actions + action_ids[action])
+        
+        rows = np.array(rows, dtype = np.int64)
+        indices = np.array(indices, dtype = np.int64)
+        probs = np.array(probs, dtype = np.float64)
+        entry_rows = np.repeat(np.arange(len(rows)), np.diff(indptr))
+        exp_rewards = np.bincount(entry_rows, weights = probs * np.array(rewards, dtype = np.float64),
+                                  minlength = len(rows))
+        
+        q_init = self.initial_q_stars()
+        q_flat = np.array([q_init[state][action] for state in self._states for action in self._actions],
+                          dtype = np.float64)
+        while True:
+            if DEBUG: print('.', end = '')
+            self._solver_stats['sweeps'] += 1
+            self._solver_stats['backups'] += len(self._trans_probs.get_from_states())
+            v = q_flat.reshape(num_states, num_actions).max(axis = 1) if num_actions > 0 else np.zeros(num_states)
+            q_rows = exp_rewards + gamma * np.bincount(entry_rows, weights = probs * v[indices],
+                                                       minlength = len(rows))
+            q_diff = np.abs(q_rows - q_flat[rows])
+            q_flat[rows] = q_rows
+            if instrument.ENABLED: instrument.STATS.observe('vi_residual', float(q_diff.max(initial = 0)))
+            if not np.any(q_diff >= thres):
+                if DEBUG: print('Threshold attained for q stars, exiting..')
+                break
+        
+        q = q_flat.reshape(num_states, num_actions).tolist()
+        return {state: dict(zip(self._actions, q[i])) for i, state in enumerate(self._states)}
+    
+    def compute_q_stars_prioritized(self, gamma, thres = 10 ** -4):
+        """
+        In place Gauss-Seidel backups after one full sweep, then only predecessors of states whose
+        value changed are backed up, largest bound on Bellman residual first. Stops once no state
+        can have a residual of thres or more
+        """
+        q_stars = self.initial_q_stars()
+        v_stars = {state: max(q_stars[state].values(), default = 0) for state in self._states}
+        from_states = list(self._trans_probs.get_from_states())
+        
+        # predecessors[r_state][state] is the largest prob of reaching r_state from state
+        predecessors = {state: {} for state in self._states}
+        for state in from_states:
+            for action in self._actions:
+                for r_state, prob in self._trans_probs.get_outcomes(state, action):
+                    predecessors[r_state][state] = max(prob, predecessors[r_state].get(state, 0))
+        
+        def backup(state):
+            self._solver_stats['backups'] += 1
+            for action in self._actions:
+                q_star = 0
+                for r_state, trans_prob in self._trans_probs.get_outcomes(state, action):
+                    reward = self._reward_func(state, action, r_state)
+                    q_star += trans_prob * (reward + gamma * v_stars[r_state])
+                q_stars[state][action] = q_star
+            v_star = q_stars[state][max(q_stars[state], key = q_stars[state].get)]
+            v_diff = abs(v_star - v_stars[state])
+            v_stars[state] = v_star
+            return v_diff
+        
+        queue = []
+        priorities = {}
+        def propagate(state, v_diff):
+            for pred, prob in predecessors[state].items():
+                priority = gamma * prob * v_diff + priorities.get(pred, 0)
+                if priority >= thres:
+                    priorities[pred] = priority
+                    heapq.heappush(queue, (-priority, pred))
+        
+        self._solver_stats['sweeps'] += 1
+        for state in from_states:
+            if DEBUG: print('.', end = '')
+            propagate(state, backup(state))
+        while queue:
+            priority, state = heapq.heappop(queue)
+            if priorities.get(state) != -priority:
+                continue
+            del priorities[state]
+            propagate(state, backup(state))
+        if DEBUG: print('Threshold attained for q stars, exiting..')
+        return q_stars
+    
+    def compute_q_stars_backward(self, gamma, thres = 10 ** -4):
+        """
+        Exact q stars in one backward pass over a topological order of the transition graph.
+        Self loops, such as a joker merged onto a joker, are solved in closed form. Falls back to
+        compute_q_stars if the graph has any other cycle
+        """
+        order = self.topological_order()
+        if order is None:
+            if DEBUG: print('Cycle found in transitions, falling back to value iteration..')
+            return self.compute_q_stars(gamma, thres)
+        q_stars = {state: {action: 0 for action in self._actions} for state in self._states}
+        v_stars = {state: 0 for state in self._states}
+        self._solver_stats['sweeps'] += 1
+        for state in reversed(order):
+            if state not in self._trans_probs.get_from_states():
+                continue
+            self._solver_stats['backups'] += 1
+            self_probs = {}
+            for action in self._actions:
+                q_star = 0
+                self_probs[action] = 0
+                for r_state, trans_prob in self._trans_probs.get_outcomes(state, action):
+                    reward = self._reward_func(state, action, r_state)
+                    if r_state == state:
+                        self_probs[action] += trans_prob
+                        q_star += trans_prob * reward
+                    else:
+                        q_star += trans_prob * (reward + gamma * v_stars[r_state])
+                q_stars[state][action] = q_star
+            if any(gamma * prob >= 1 for prob in self_probs.values()):
+                return self.compute_q_stars(gamma, thres)
+            # Each q is q_star + gamma * self_prob * v, so v is the largest fixed point of those lines
+            v_stars[state] = max(q_stars[state][action] / (1 - gamma * self_probs[action]) \
+                                 for action in self._actions)
+            for action in self._actions:
+                q_stars[state][action] += gamma * self_probs[action] * v_stars[state]
+        return q_stars
+    
+    def topological_order(self):
+        """
+        :return: list of states with every state before its result states, ignoring self loops.
+                 None if there is a cycle
+        """
+        in_degrees = {state: 0 for state in self._states}
+        successors = {}
+        for state in self._trans_probs.get_from_states():
+            successors[state] = {r_state for action in self._actions \
+                                 for r_state in self._trans_probs.get_result_states(state, action) if r_state != state}
+            for r_state in successors[state]:
+                in_degrees[r_state] += 1
+        order = [state for state in self._states if in_degrees[state] == 0]
+        for state in order:
+            for r_state in successors.get(state, ()):
+                in_degrees[r_state] -= 1
+                if in_degrees[r_state] == 0:
+                    order.append(r_state)
+        if len(order) < len(self._states):
+            return None
+        return order
+    
     def compute_v_stars(self):
         q_stars = self._q_stars
         return {state: q_stars[state][max(q_stars[state], key = q_stars[state].get)] for state in self._states}
@@ -97,6 +348,13 @@ class MDP:
                 print('Threshold attained for v stars, exiting..')
                 return v_stars
         
+    @property
+    def solver_stats(self):
+        """
+        :return: dict of sweeps and state backups done by the solver
+        """
+        return self._solver_stats
+        
     @property
     def q_stars(self):
         return self._q_stars
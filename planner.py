@@ -0,0 +1,173 @@
+import mdp
+import instrument
+from board import Board
+
+def transitions(s_a_r_dict):
+    """
+    :param s_a_r_dict: dict of {state_key: {action: result_board}} from Board.mdp_params
+    :return: states, actions, trans_probs and {(state, action, result_state): reward} for mdp.MDP
+    """
+    state_keys = []
+    actions = []
+    trans_probs = []
+    rewards = {}
+
+    for state, action_dict in s_a_r_dict.items():
+        state_keys.append(state)
+        for action, result in action_dict.items():
+            state_keys.append(result.key())
+            actions.append(action)
+            trans_probs.append([state, action, result.key(), 1 / Board.DECK_LIMIT])
+            rewards[(state, action, result.key())] = result.dps_delta()
+
+    state_keys = list(set(state_keys))
+    actions = list(set(actions))
+    
+    return state_keys, actions, trans_probs, rewards
+
+def stochastic_transitions(s_a_o_dict):
+    """
+    :param s_a_o_dict: dict of {state_key: {action: {result_key: (result_board, prob)}}}
+                       from Board.stochastic_params
+    :return: states, actions, mdp.Transition and {(state, action, result_state): reward} for mdp.MDP
+    """
+    state_keys = set(s_a_o_dict)
+    actions = set()
+    rewards = {}
+    
+    for state, action_dict in s_a_o_dict.items():
+        for action, outcomes in action_dict.items():
+            actions.add(action)
+            for key, (result, prob) in outcomes.items():
+                state_keys.add(key)
+                rewards[(state, action, key)] = result.dps_delta()
+    
+    state_keys = list(state_keys)
+    actions = list(actions)
+    trans_probs = mdp.Transition(state_keys, actions)
+    for state, action_dict in s_a_o_dict.items():
+        for action, outcomes in action_dict.items():
+            trans_probs.add_outcomes(state, action, tuple(outcomes), tuple(prob for result, prob in outcomes.values()))
+    
+    return state_keys, actions, trans_probs, rewards
+
+class Planner:
+    
+    def __init__(self, deck, depth = 3, breadth = 10, gamma = 0.5, solver = 'dict', pool = None, table = None,
+                 stochastic = False, heuristic = 'dps', unique = False):
+        """
+        Keeps the search graph and q stars of the last plan, so the next plan only expands new
+        boards and starts solving from the retained values
+        :param pool, table: passed on to Board.mdp_params
+        :param stochastic: search Board.stochastic_params instead, where every outcome has its
+                           own state and prob. pool and table are not used, and outcomes are
+                           always kept once each, as with unique
+        :param heuristic: beam score of either search, see Board.select_beam
+        :param unique: passed on to Board.mdp_params
+        """
+        self._deck = deck
+        self._depth = depth
+        self._breadth = breadth
+        self._gamma = gamma
+        self._solver = solver
+        self._pool = pool
+        self._table = table
+        self._stochastic = stochastic
+        self._heuristic = heuristic
+        self._unique = unique
+        self._beam_stats = []
+        self._s_a_r_dict = {}
+        self._q_stars = {}
+        self._stats = instrument.Stats()
+        
+    @property
+    def stats(self):
+        """
+        :return: instrument.Stats of every search and solve done by this planner while
+                 instrument.ENABLED is set
+        """
+        return self._stats
+    
+    @property
+    def beam_stats(self):
+        """
+        :return: list of the per layer counts of the last search, see Board.mdp_params
+        """
+        return self._beam_stats
+        
+    def plan(self, board):
+        """
+        :return: mdp.MDP solved over the search graph rooted at board
+        """
+        self.search(board)
+        return self.solve()
+    
+    def search(self, board):
+        """
+        :return: dict of {action: result_board} legal on board, or {action: outcomes} if stochastic
+        """
+        self._beam_stats = []
+        with instrument.collect(self._stats), instrument.timer('search'):
+            if self._stochastic:
+                self._s_a_r_dict = board.stochastic_params(self._depth, self._breadth, expanded = self._s_a_r_dict,
+                                                           heuristic = self._heuristic, beam_stats = self._beam_stats)
+            else:
+                self._s_a_r_dict = board.mdp_params(self._depth, self._breadth, self._pool, self._table,
+                                                    expanded = self._s_a_r_dict, heuristic = self._heuristic,
+                                                    unique = self._unique, beam_stats = self._beam_stats)
+        return self._s_a_r_dict[board.key()]
+    
+    def solve(self):
+        """
+        :return: mdp.MDP solved over the graph of the last search, warm started from the last solve
+        """
+        with instrument.collect(self._stats):
+            with instrument.timer('transitions'):
+                if self._stochastic:
+                    states, actions, trans_probs, rewards = stochastic_transitions(self._s_a_r_dict)
+                else:
+                    states, actions, trans_probs, rewards = transitions(self._s_a_r_dict)
+            
+            def reward_func(state, action, result_state):
+                return rewards[(state, action, result_state)]
+            
+            model = mdp.MDP(states, actions, trans_probs, reward_func, self._gamma,
+                            solver = self._solver, q_init = self._q_stars)
+        self._q_stars = model.q_stars
+        return model
+    
+    def recommend(self, board):
+        """
+        :return: (action, v_star, {action: q_star}) over the actions legal on board.
+                 action is None and v_star is 0 when there are none
+        """
+        legal = self.search(board)
+        if len(legal) == 0:
+            return None, 0, {}
+        model = self.solve()
+        q_stars = {action: model.q_stars[board.key()][action] for action in legal}
+        action = max(q_stars, key = q_stars.get)
+        return action, q_stars[action], q_stars
+    
+    def reset(self):
+        self._s_a_r_dict = {}
+        self._q_stars = {}
+
+# Planner of this process kept warm between boards, with the deck and settings it was built for
+WARM = None
+
+def warm_planner(deck, *args, **kwargs):
+    """
+    Planner of this process for deck, rebuilt along with the Board state of deck whenever deck or
+    the Planner arguments change. For workers that answer many boards
+    :param args, kwargs: Planner arguments after deck
+    :return: Planner
+    """
+    global WARM
+    key = (tuple(deck), args, tuple(sorted(kwargs.items())))
+    if WARM is None or WARM[0] != key:
+        # Cleared first, so a deck that new_board rejects is never taken for the current one
+        WARM = None
+        Board.new_board(list(deck))
+        WARM = (key, Planner(list(deck), *args, **kwargs))
+    return WARM[1]
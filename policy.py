@@ -0,0 +1,181 @@
+import sys
+import json
+import time
+import struct
+import argparse
+import multiprocessing as mp
+import catalog
+from board import Board
+from planner import Planner, warm_planner
+
+MAGIC = b'MDPPOLICY2'
+# Canonical state key, index of the action in the header, v star
+RECORD = struct.Struct(f'<{Board.CELL_LIMIT}sHd')
+
+def solve_state(args):
+    """
+    :param args: (state_key, deck, (depth, breadth, gamma, solver))
+    :return: (state_key, action, v_star) of the board, action is None if it has no step
+    """
+    key, deck, settings = args
+    planner = warm_planner(deck, *settings)
+    # Every board is solved from scratch so the table does not depend on the order it is built in
+    planner.reset()
+    action, v_star, q_stars = planner.recommend(Board.from_key(key, deck))
+    return key, action, v_star
+
+def compile_table(deck, path, max_fill = 2, max_pip = 2, settings = (3, 10, 0.5, 'dict'), processes = None):
+    """
+    Solves every board of Board.reachable_states and writes the step of each to path
+    :return: number of boards written
+    """
+    Board.new_board(deck)
+    tasks = ((board.key(), deck, settings) for board in Board.reachable_states(deck, max_fill, max_pip))
+    pool = mp.Pool(processes) if processes else None
+    rows = pool.imap(solve_state, tasks, chunksize = 16) if pool is not None else map(solve_state, tasks)
+    actions = {}
+    records = bytearray()
+    try:
+        for key, action, v_star in rows:
+            if action is None:
+                continue
+            records += RECORD.pack(key.to_bytes(Board.CELL_LIMIT, 'little'), actions.setdefault(action, len(actions)),
+                                   v_star)
+    finally:
+        if pool is not None:
+            pool.close()
+    depth, breadth, gamma, solver = settings
+    header = json.dumps({
+        'deck': deck,
+        'depth': depth,
+        'breadth': breadth,
+        'gamma': gamma,
+        'solver': solver,
+        'combo_count': Board.COMBO_COUNT,
+        'version': catalog.version(Board.DICE_PATH),
+        'actions': list(actions)
+    }).encode()
+    with open(path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header)) + header + records)
+    return len(records) // RECORD.size
+
+class PolicyTable:
+
+    def __init__(self, path):
+        """
+        Policy written by compile_table, held as a dict of {canonical_key: (action, v_star)}
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        assert data.startswith(MAGIC), f'Not a policy table: {path}'
+        offset = len(MAGIC) + 4
+        header_size = struct.unpack_from('<I', data, len(MAGIC))[0]
+        self._header = json.loads(data[offset:offset + header_size])
+        actions = self._header['actions']
+        self._policy = {int.from_bytes(key, 'little'): (actions[action], v_star) \
+                        for key, action, v_star in RECORD.iter_unpack(data[offset + header_size:])}
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def header(self):
+        return self._header
+
+    def matches(self, deck):
+        """
+        :return: True if the table was compiled for deck under the current catalog and combo count
+        """
+        return self._header['deck'] == list(deck) and self._header['combo_count'] == Board.COMBO_COUNT \
+            and self._header['version'] == catalog.version(Board.DICE_PATH)
+
+    def lookup(self, board):
+        """
+        :return: (action, v_star) for board, None if it is not in the table
+        """
+        key, perm = board.canonical()
+        entry = self._policy.get(key)
+        if entry is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        return Board.mirror_action(entry[0], perm), entry[1]
+
+    def recommend(self, board, planner):
+        """
+        :param planner: Planner searched live when board is not in the table
+        :return: (action, v_star, True if it came from the table)
+        """
+        entry = self.lookup(board)
+        if entry is not None:
+            return entry[0], entry[1], True
+        action, v_star, q_stars = planner.recommend(board)
+        return action, v_star, False
+
+    def clear(self):
+        self._policy = {}
+
+    def stats(self):
+        return {'hits': self._hits, 'misses': self._misses, 'size': len(self._policy)}
+
+    def __len__(self):
+        return len(self._policy)
+
+def serve(table, lines, out, planner):
+    """
+    Writes one JSON recommendation per non-empty line of state_str to out
+    :return: number of rows written
+    """
+    count = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        row = {'state': line.strip()}
+        try:
+            action, v_star, hit = table.recommend(Board.parse_state_str(line.strip(), table.header['deck']), planner)
+            row.update({'action': action, 'v': v_star, 'hit': hit})
+        except (AssertionError, KeyError, ValueError) as e:
+            row['error'] = str(e)
+        out.write(json.dumps(row) + '\n')
+        count += 1
+    return count
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Compile a policy table offline, or serve steps from one')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    build = commands.add_parser('compile', help = 'solve every reachable board up to a fill level')
+    build.add_argument('deck', help = 'comma separated deck')
+    build.add_argument('-o', '--output', default = 'policy.bin')
+    build.add_argument('--fill', type = int, default = 2, help = 'max number of dice on a board')
+    build.add_argument('--max-pip', type = int, default = 2)
+    build.add_argument('--depth', type = int, default = 3)
+    build.add_argument('--breadth', type = int, default = 10)
+    build.add_argument('--gamma', type = float, default = 0.5)
+    build.add_argument('--solver', default = 'dict')
+    build.add_argument('--processes', type = int)
+    lookup = commands.add_parser('serve', help = 'answer lines of state_str, searching live on misses')
+    lookup.add_argument('table')
+    lookup.add_argument('input', nargs = '?', default = '-', help = 'lines of state_str, - for stdin')
+    lookup.add_argument('-o', '--output', default = '-', help = 'JSONL output, - for stdout')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    if args.command == 'compile':
+        count = compile_table(args.deck.split(','), args.output, args.fill, args.max_pip,
+                              (args.depth, args.breadth, args.gamma, args.solver), args.processes)
+        print(f'{count} boards in {time.time() - start:.2f}s', file = sys.stderr)
+        return
+    table = PolicyTable(args.table)
+    header = table.header
+    Board.new_board(header['deck'])
+    if not table.matches(header['deck']):
+        print('Policy table is stale, every board is searched live', file = sys.stderr)
+        table.clear()
+    planner = Planner(header['deck'], header['depth'], header['breadth'], header['gamma'], header['solver'])
+    lines = sys.stdin if args.input == '-' else open(args.input)
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    count = serve(table, lines, out, planner)
+    out.flush()
+    print(f'{count} rows in {time.time() - start:.2f}s, {table.stats()}', file = sys.stderr)
+
+if __name__ == '__main__':
+    main()
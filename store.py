@@ -0,0 +1,123 @@
+import os
+import sqlite3
+import catalog
+
+class Store:
+
+    # Tables of an older SCHEMA_VERSION are dropped and recreated
+    SCHEMA_VERSION = '2'
+    TABLES = ['dps', 'solved']
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS dps (params TEXT, key BLOB, dps REAL, PRIMARY KEY (params, key))',
+        'CREATE TABLE IF NOT EXISTS solved (params TEXT, key BLOB, v REAL, pi TEXT, PRIMARY KEY (params, key))'
+    ]
+
+    def __init__(self, path, key_bytes = 15, max_rows = 2 ** 20, dice_path = None):
+        """
+        SQLite file of DPS values and solved boards shared between sessions and processes.
+        Everything stored is dropped whenever the dice catalog changes
+        :param key_bytes: length of the blobs that state keys are stored as
+        :param max_rows: rows kept per table before the oldest written are dropped
+        :param dice_path: catalog the store is versioned by, defaults to catalog.DICE_PATH
+        """
+        assert max_rows > 0, f'Invalid max_rows provided: {max_rows}'
+        self._path = path
+        self._key_bytes = key_bytes
+        self._max_rows = max_rows
+        self._version = catalog.version(dice_path)
+        self._conn = None
+        self._pid = None
+        conn = self.connection()
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+            row = conn.execute("SELECT value FROM meta WHERE name = 'schema'").fetchone()
+            if row is None or row[0] != Store.SCHEMA_VERSION:
+                for table in Store.TABLES:
+                    conn.execute(f'DROP TABLE IF EXISTS {table}')
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('schema', ?)", (Store.SCHEMA_VERSION,))
+            for statement in Store.SCHEMA:
+                conn.execute(statement)
+            row = conn.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+            if row is None or row[0] != self._version:
+                conn.execute('DELETE FROM dps')
+                conn.execute('DELETE FROM solved')
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (self._version,))
+
+    def connection(self):
+        """
+        :return: sqlite3 connection of the current process, opened on first use
+        """
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self._path, timeout = 30)
+            self._conn.execute('PRAGMA journal_mode = WAL')
+            self._conn.execute('PRAGMA synchronous = NORMAL')
+            self._pid = os.getpid()
+        return self._conn
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        return state
+
+    def blob(self, key):
+        return key.to_bytes(self._key_bytes, 'little')
+
+    def get_dps(self, params, limit = None):
+        """
+        :param params: Board.dps_params the values were computed with
+        :param limit: max number of values returned, most recently written first
+        :return: dict of {state_key: dps}
+        """
+        rows = self.connection().execute('SELECT key, dps FROM dps WHERE params = ? ORDER BY rowid DESC LIMIT ?',
+                                         (repr(params), -1 if limit is None else limit))
+        return {int.from_bytes(key, 'little'): dps for key, dps in rows}
+
+    def put_dps(self, params, values):
+        """
+        :param values: iterable of (state_key, dps)
+        """
+        conn = self.connection()
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO dps VALUES (?, ?, ?)',
+                             ((repr(params), self.blob(key), dps) for key, dps in values))
+            self.trim('dps')
+
+    def get_solved(self, params, key):
+        """
+        :param params: tuple of everything the solve depends on besides the board, starting with
+                       Board.dps_params, then the search and solver settings
+        :return: (v_star, pi_star) stored for the board, None if it was never solved under params
+        """
+        row = self.connection().execute('SELECT v, pi FROM solved WHERE params = ? AND key = ?',
+                                        (repr(params), self.blob(key)))
+        return row.fetchone()
+
+    def put_solved(self, params, key, v, pi):
+        conn = self.connection()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO solved VALUES (?, ?, ?, ?)', (repr(params), self.blob(key), v, pi))
+            self.trim('solved')
+
+    def trim(self, table):
+        """
+        Drops the oldest written rows of table beyond max_rows
+        """
+        conn = self.connection()
+        excess = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] - self._max_rows
+        if excess > 0:
+            conn.execute(f'DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} ORDER BY rowid LIMIT ?)',
+                         (excess,))
+
+    def stats(self):
+        conn = self.connection()
+        return {
+            'version': self._version,
+            'dps': conn.execute('SELECT COUNT(*) FROM dps').fetchone()[0],
+            'solved': conn.execute('SELECT COUNT(*) FROM solved').fetchone()[0],
+            'max_rows': self._max_rows
+        }
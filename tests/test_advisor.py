@@ -0,0 +1,67 @@
+import time
+import asyncio
+import concurrent.futures as cf
+from board import Board
+from advisor import Advisor
+
+DECK = ['c', 'j', 'o', 'g', 'm']
+SETTINGS = {'depth': 2, 'breadth': 5, 'gamma': 0.5, 'solver': 'dict'}
+
+def board():
+    b = Board.new_board(DECK)
+    for cell, dice in [(0, 'c'), (1, 'c'), (5, 'o')]:
+        b = b.spawn_dice(dice, cell, 1)
+    return b
+
+def busy(executor):
+    """
+    Fills the only worker and its call queue, so the next solve stays pending and can be cancelled
+    """
+    for i in range(3):
+        executor.submit(time.sleep, 0.2)
+
+def test_cancelled_advice_then_same_board(capsys):
+    b = board()
+    
+    async def scenario():
+        with cf.ProcessPoolExecutor(1) as executor:
+            advisor = Advisor(DECK, executor, SETTINGS)
+            busy(executor)
+            task = asyncio.ensure_future(advisor.advise(b))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            # A command that fails leaves the board unchanged
+            advisor.retain(b)
+            await advisor.advise(b)
+            return advisor.stats()
+    
+    stats = asyncio.run(scenario())
+    assert 'Optimal step' in capsys.readouterr().out
+    assert stats['cancelled'] == 0
+
+def test_cancelled_solve_is_resubmitted(capsys):
+    b = board()
+    
+    async def scenario():
+        with cf.ProcessPoolExecutor(1) as executor:
+            advisor = Advisor(DECK, executor, SETTINGS)
+            busy(executor)
+            assert advisor.submit(b).cancel()
+            await advisor.advise(b)
+    
+    asyncio.run(scenario())
+    assert 'Optimal step' in capsys.readouterr().out
+
+def test_stochastic_advice_speculates_spawns(capsys):
+    b = board()
+    
+    async def scenario():
+        with cf.ProcessPoolExecutor(1) as executor:
+            advisor = Advisor(DECK, executor, dict(SETTINGS, stochastic = True))
+            await advisor.advise(b)
+            return advisor
+    
+    advisor = asyncio.run(scenario())
+    assert 'Optimal step' in capsys.readouterr().out
+    spawned = {outcome.key() for outcome, prob in b.spawn_outcomes().values()}
+    assert spawned & {key for key, params in advisor._futures}
@@ -0,0 +1,35 @@
+import pytest
+import batch
+import planner
+from board import Board
+
+DECK = ['c', 'j', 'o', 'g', 'm']
+STATE = ','.join(['c1', 'j1', '0', 'o2', 'g1'] + ['0'] * 10)
+
+@pytest.fixture(autouse = True)
+def fresh_state():
+    planner.WARM = None
+    yield
+    planner.WARM = None
+
+def advise(line):
+    return batch.advise((line, DECK, (2, 5, 0.5, 'dict')))
+
+def test_bad_deck_does_not_corrupt_later_lines():
+    expected = advise(STATE)
+    planner.WARM = None
+    rows = [advise(STATE), advise(f'{STATE} c,j,o,g,zz'), advise(STATE)]
+    assert 'error' not in rows[0] and 'error' not in rows[2]
+    assert rows[2]['action'] == expected['action']
+    assert rows[2]['v'] == pytest.approx(expected['v'])
+
+def test_unknown_dice_error_names_the_dice():
+    advise(STATE)
+    placeholder_dps = Board.PLACEHOLDER_DPS
+    row = advise(f'{STATE} c,j,o,g,zz')
+    assert 'zz' in row['error']
+    assert Board.PLACEHOLDER_DPS == placeholder_dps
+
+def test_short_deck_error():
+    row = advise(f'{STATE} c,j,o')
+    assert 'deck length' in row['error']
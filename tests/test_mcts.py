@@ -0,0 +1,34 @@
+from board import Board
+from mcts import MCTSPlanner
+
+DECK = ['c', 'j', 'o', 'g', 'm']
+
+def board():
+    b = Board.new_board(DECK)
+    for cell, dice in [(0, 'c'), (1, 'j'), (4, 'o'), (7, 'g'), (8, 'g')]:
+        b = b.spawn_dice(dice, cell, 1)
+    return b
+
+def test_every_rollout_is_counted():
+    result = MCTSPlanner(DECK, horizon = 4, seed = 1).search(board(), rollouts = 50)
+    assert result['rollouts'] == 50
+
+def test_tree_does_not_carry_over_between_searches():
+    planner = MCTSPlanner(DECK, horizon = 4, seed = 1)
+    b = board()
+    planner.search(b, rollouts = 30)
+    combo_count = Board.COMBO_COUNT
+    Board.COMBO_COUNT += 1
+    try:
+        result = planner.search(b, rollouts = 20)
+    finally:
+        Board.COMBO_COUNT = combo_count
+    assert result['rollouts'] == 20
+
+def test_budget_below_number_of_actions():
+    b = board()
+    planner = MCTSPlanner(DECK, horizon = 4, seed = 1)
+    result = planner.search(b, rollouts = 3)
+    assert len(b.next_states()) > 3
+    assert result['rollouts'] == 3 and len(result['actions']) <= 3
+    assert planner.search(b, time_limit = 0)['action'] is None
@@ -0,0 +1,20 @@
+from board import Board
+from planner import Planner
+
+DECK = ['c', 'j', 'o', 'g', 'm']
+
+def board():
+    b = Board.new_board(DECK)
+    for cell, dice in [(0, 'c'), (1, 'c'), (5, 'o')]:
+        b = b.spawn_dice(dice, cell, 1)
+    return b
+
+def test_stochastic_search_uses_heuristic():
+    scored = []
+    def heuristic(b):
+        scored.append(b.key())
+        return b.dps()
+    planner = Planner(DECK, 2, 5, stochastic = True, heuristic = heuristic)
+    action, v_star, q_stars = planner.recommend(board())
+    assert action is not None
+    assert len(scored) == planner.beam_stats[0]['candidates'] > 0
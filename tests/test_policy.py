@@ -0,0 +1,15 @@
+import policy
+from board import Board
+from planner import Planner
+
+DECK = ['c', 'j', 'o', 'g', 'm']
+
+def test_settings_of_earlier_compile_are_not_reused(tmp_path):
+    settings = (1, 1, 0.9, 'dict')
+    policy.compile_table(DECK, str(tmp_path / 'first.bin'), max_fill = 2, max_pip = 1, settings = (2, 5, 0.5, 'dict'))
+    policy.compile_table(DECK, str(tmp_path / 'second.bin'), max_fill = 2, max_pip = 1, settings = settings)
+    table = policy.PolicyTable(str(tmp_path / 'second.bin'))
+    assert len(table) > 0
+    for key, (action, v_star) in table._policy.items():
+        expected = Planner(DECK, *settings).recommend(Board.from_key(key, DECK))
+        assert (action, v_star) == expected[:2]
@@ -0,0 +1,37 @@
+import sqlite3
+from board import Board
+from store import Store
+
+DECK = ['c', 'j', 'o', 'g', 'm']
+
+def solve_params(depth = 3, breadth = 10):
+    return (Board.dps_params(DECK), depth, breadth, 0.5, 'dict', False, 'dps', False)
+
+def test_solved_rows_are_keyed_by_combo_count(tmp_path):
+    store = Store(str(tmp_path / 'store.db'))
+    Board.new_board(DECK)
+    combo_count = Board.COMBO_COUNT
+    try:
+        store.put_solved(solve_params(), 1, 10.0, 'g_1')
+        assert store.get_solved(solve_params(), 1) == (10.0, 'g_1')
+        Board.COMBO_COUNT += 1
+        assert store.get_solved(solve_params(), 1) is None
+        store.put_solved(solve_params(), 1, 12.0, 'm_1_2')
+        assert store.get_solved(solve_params(), 1) == (12.0, 'm_1_2')
+    finally:
+        Board.COMBO_COUNT = combo_count
+    assert store.get_solved(solve_params(), 1) == (10.0, 'g_1')
+    assert store.get_solved(solve_params(breadth = 5), 1) is None
+    store.close()
+
+def test_old_schema_is_recreated(tmp_path):
+    path = str(tmp_path / 'store.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE solved (deck TEXT, key BLOB, depth INTEGER, breadth INTEGER, gamma REAL, '
+                 'stochastic INTEGER, v REAL, pi TEXT, PRIMARY KEY (deck, key, depth, breadth, gamma, stochastic))')
+    conn.commit()
+    conn.close()
+    store = Store(path)
+    store.put_solved(solve_params(), 1, 10.0, 'g_1')
+    assert store.get_solved(solve_params(), 1) == (10.0, 'g_1')
+    store.close()